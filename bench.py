@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+'''
+NAME
+  bench.py - benchmarks for pcloud utilities
+
+SYNOPSIS
+  python bench.py [--output file] [--repeat n] [--quick] [benchmark ...]
+
+DESCRIPTION
+  Runs benchmarks of the binary API codec, binary API transport,
+  pcutil.py recursive copies, playlist.py music folder walks and
+  command start-up (interpreter start, imports and configuration
+  load, against a bare interpreter start as baseline). The
+  transport and copy benchmarks run against an in-process
+  mockserver.py, so no network access is required.
+
+  If benchmark names are given, only benchmarks whose names start with
+  one of them are run. Each benchmark is run repeat times (default 3)
+  and the best time reported. --quick reduces problem sizes for a fast
+  sanity check.
+
+  Results are written as JSON to file (default: stdout), for
+  comparison across commits.
+'''
+
+import sys
+import os
+import json
+import time
+import getopt
+import platform
+import shutil
+import subprocess
+import tempfile
+import binapi
+import pcloudapi
+import pcutil
+import playlist
+import mockserver
+
+benchmarks = []
+
+def benchmark(name):
+    '''Decorator registering a benchmark generator function.
+
+    The function is called with the size scale (1 normally, smaller
+    for --quick) and yields tuples of (params, run, units), where run
+    is a function to be timed and units the amount of work run does
+    (e.g. bytes or calls), used to compute a rate.
+    '''
+    def register(fn):
+        benchmarks.append((name, fn))
+        return fn
+    return register
+
+def listing(nfiles, depth, fanout=10):
+    '''Return synthetic pCloud folder contents of nfiles files, spread
+       over folders nested depth deep.'''
+    id = 0
+    def folder(level, nfiles):
+        nonlocal id
+        contents = []
+        nsub = fanout if level < depth else 0
+        nhere = nfiles // (nsub + 1) if nsub else nfiles
+        for i in range(nhere):
+            id += 1
+            contents.append({'name': f'track {id:06}.mp3', 'fileid': id,
+                             'isfolder': False, 'size': 4000000 + id,
+                             'hash': id * 7919,
+                             'modified': 'Mon, 01 Jan 2024 00:00:00 +0000'})
+        for i in range(nsub):
+            id += 1
+            contents.append({'name': f'album {id:06}', 'folderid': id,
+                             'isfolder': True,
+                             'contents': folder(level + 1,
+                                                (nfiles - nhere) // nsub)})
+        return contents
+    return folder(0, nfiles)
+
+@benchmark('codec.encode')
+def bench_encode(scale):
+    for size in (10, 1000, 30000):
+        params = {'path': '/' + 'x' * size, 'folderid': 12345,
+                  'recursive': True}
+        yield ({'param_bytes': size},
+               lambda: [binapi.encode('listfolder', params)
+                        for i in range(1000)], 1000)
+
+@benchmark('codec.decode')
+def bench_decode(scale):
+    for nfiles, depth in ((10, 0), (1000, 1), (20000 // scale, 3)):
+        msg = mockserver.encode_value(
+            {'result': 0, 'metadata': {'name': 'Music', 'folderid': 1,
+                                       'contents': listing(nfiles, depth)}})
+        yield ({'files': nfiles, 'depth': depth, 'bytes': len(msg)},
+               lambda: binapi.decode(msg), nfiles)
+
+def mock_pcloud(server):
+    '''Return PCloud instance configured to use mock server.'''
+    pcloud = pcloudapi.PCloud()
+    pcloud.config.update(server.config())
+    pcloud.auth = pcloud.config[pcloudapi.Key.TOKEN]
+    # always the mock server itself, without endpoint discovery
+    pcloud.config[pcloudapi.Key.AUTO_ENDPOINT] = False
+    pcloud.config[pcutil.Key.ASPECT] = {pcutil.Key.JOBS:
+                                        binapi.PIPELINE_WINDOW,
+                                        pcutil.Key.WORKERS: pcutil.WORKERS}
+    return pcloud
+
+@benchmark('transport')
+def bench_transport(scale):
+    server = mockserver.MockServer()
+    server.start()
+    pcloud = mock_pcloud(server)
+    ncalls = 2000 // scale
+    try:
+        with pcloud.session():
+            pass # open a connection, before timing
+        yield ({'calls': ncalls, 'mode': 'serial'},
+               lambda: [pcloud.binary_request('stat', {'path': '/'})
+                        for i in range(ncalls)], ncalls)
+        yield ({'calls': ncalls, 'mode': 'pipelined'},
+               lambda: pcloud.binary_requests(
+                   [('stat', {'path': '/'}, b'')] * ncalls), ncalls)
+        size = 16 * 1024 * 1024 // scale
+        data = os.urandom(size)
+        yield ({'bytes': size, 'mode': 'upload'},
+               lambda: pcloud.binary_request('uploadfile',
+                                             {'folderid': 0,
+                                              'filename': 'upload.bin'},
+                                             data), size)
+    finally:
+        binapi.pool.close()
+        server.stop()
+    return
+
+def make_tree(root, nfiles, size, fanout=8):
+    '''Create local tree of nfiles files of size bytes under root.'''
+    data = os.urandom(size)
+    for i in range(nfiles):
+        folder = os.path.join(root, f'd{i % fanout}', f'e{i % 3}')
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'f{i}'), 'wb') as f:
+            f.write(data)
+    return
+
+@benchmark('pcutil.copy')
+def bench_copy(scale):
+    server = mockserver.MockServer()
+    server.start()
+    pcloud = mock_pcloud(server)
+    tmp = tempfile.mkdtemp(prefix='pcloud-bench-')
+
+    def copy(pairs, workers=pcutil.WORKERS, recursive=True):
+        pcutil.folder_cache = pcutil.FolderCache()
+        aspect = pcloud.config[pcutil.Key.ASPECT]
+        aspect[pcutil.Key.WORKERS] = workers
+        if recursive:
+            aspect[pcutil.Key.RECURSIVE] = True
+        else:
+            aspect.pop(pcutil.Key.RECURSIVE, None)
+        pcutil.copy_files(pcloud, pairs)
+        return
+
+    try:
+        for name, nfiles, size in (('small', 500 // scale, 1024),
+                                   ('large', 4, 8 * 1024 * 1024 // scale)):
+            source = os.path.join(tmp, name)
+            make_tree(source, nfiles, size)
+            params = {'files': nfiles, 'file_bytes': size}
+            yield (dict(params, direction='upload'),
+                   lambda: copy([(source, 'p:/bench')]), nfiles * size)
+            yield (dict(params, direction='upload', workers=1),
+                   lambda: copy([(source, 'p:/bench')], 1), nfiles * size)
+            dest = os.path.join(tmp, 'download')
+            yield (dict(params, direction='download'),
+                   lambda: copy([(f'p:/bench/{name}/', dest)]),
+                   nfiles * size)
+            # the same files, as individual pairs (cp --from-file)
+            pairs = [(os.path.join(root, file),
+                      f'p:/pairs/{name}/{os.path.relpath(root, source)}/'
+                      f'{file}')
+                     for root, _, files in os.walk(source) for file in files]
+            yield (dict(params, direction='upload', mode='pairs'),
+                   lambda: copy(pairs, recursive=False), nfiles * size)
+    finally:
+        shutil.rmtree(tmp)
+        binapi.pool.close()
+        server.stop()
+    return
+
+@benchmark('playlist.walk')
+def bench_walk(scale):
+    for nfiles, depth in ((10000, 1), (200000 // scale, 3)):
+        folder = listing(nfiles, depth)
+        yield ({'files': nfiles, 'depth': depth},
+               lambda: playlist.get_music_dict(folder, ['.mp3', '.flac']),
+               nfiles)
+
+@benchmark('startup')
+def bench_startup(scale):
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, code in (('python', 'pass'),
+                       ('pcutil', 'import pcutil, pcloudapi; '
+                        'pcloudapi.PCloud()'),
+                       ('playlist', 'import playlist, pcloudapi; '
+                        'pcloudapi.PCloud()')):
+        yield ({'import': name},
+               lambda: subprocess.run([sys.executable, '-c', code],
+                                      cwd=here, check=True), 1)
+
+def run(names, repeat, scale):
+    results = []
+    for name, fn in benchmarks:
+        if names and not any(name.startswith(n) for n in names):
+            continue
+        for params, work, units in fn(scale):
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                work()
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            results.append({'name': name, 'params': params,
+                            'seconds': best, 'times': times,
+                            'rate': units / best if best else None})
+            print(f'{name} {params}: {best:.4f}s', file=sys.stderr)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True,
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def main():
+    output = ''
+    repeat = 3
+    scale = 1
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '',
+                                   ['output=', 'repeat=', 'quick'])
+        for o, v in opts:
+            if o == '--output':
+                output = v
+            elif o == '--repeat':
+                repeat = int(v)
+            elif o == '--quick':
+                scale = 10
+    except (getopt.GetoptError, ValueError) as err:
+        pcloudapi.error(err)
+
+    # pcloudapi writes its default configuration file, and caches,
+    # under HOME; keep them out of the user's own, and remove them
+    # afterwards
+    home = os.environ.get('HOME')
+    with tempfile.TemporaryDirectory(prefix='pcloud-bench-') as tmp_home:
+        os.environ['HOME'] = tmp_home
+        try:
+            results = run(args, repeat, scale)
+        finally:
+            if home is None:
+                del os.environ['HOME']
+            else:
+                os.environ['HOME'] = home
+    report = {'commit': git_commit(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'results': results}
+    if output:
+        pcloudapi.save_json(report, output, indent='  ')
+    else:
+        json.dump(report, sys.stdout, indent='  ')
+        print()
+    return
+
+if __name__ == '__main__':
+    main()
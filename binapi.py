@@ -7,13 +7,9 @@
 
 import socket
 import ssl
-import urllib.parse
-import urllib.request
-
-# Globals
-sock = None
-ssock = None
-intern_str = [] # Holds reused strings within method response
+import select
+import threading
+import profiler
 
 # Constants
 # Binary interface types
@@ -22,6 +18,13 @@ ARRAY = 17
 BOOL_FALSE = 18
 BOOL_TRUE = 19
 DATA = 20
+END = 255
+
+# Maximum number of requests sent ahead of their responses
+PIPELINE_WINDOW = 32
+
+# Size of data chunks sent when reporting progress
+SEND_CHUNK = 65536
 
 def is_str(code):
     'Is pCloud string?'
@@ -36,15 +39,16 @@ def ei(value, size):
     bval = value.to_bytes(size, byteorder='little')
     return bval
 
-def encode(method, params = {}, data = b''):
-    'Encode pCloud API call into binary format'
+def encode_header(method, params = {}, data_length = 0):
+    '''Encode pCloud API call into binary format, excluding the
+       data_length bytes of data which must follow.'''
     method_len = len(method)
     method_name = method.encode()
     bparams = bytearray()
     data_len = b''
-    if len(data) != 0:
+    if data_length != 0:
         method_len |= (1 << 7)
-        data_len = ei(len(data), 8)
+        data_len = ei(data_length, 8)
     nparams = len(params)
     if params:
         for k,v in params.items():
@@ -64,139 +68,359 @@ def encode(method, params = {}, data = b''):
 
     # add 1 byte for method length and 1 byte for param count + optional
     # data length of 8 bytes
-    msg_len = ei((len(method_name) + len(bparams) + 2 + (8 if data else 0)), 2)
+    msg_len = ei((len(method_name) + len(bparams) + 2 +
+                  (8 if data_length else 0)), 2)
     return msg_len + ei(method_len,1) + data_len + \
-        method_name + ei(nparams, 1) + bparams + data
+        method_name + ei(nparams, 1) + bparams
+
+def encode(method, params = {}, data = b''):
+    'Encode pCloud API call into binary format'
+    return encode_header(method, params, len(data)) + data
 
 def di(b):
     'Decode bytes in little endian format to an int'
     return int.from_bytes(b, 'little')
 
-def decode_int(msg):
-    'Decode int from msg. Return tuple of remaining msg contents and int.'
-    code = msg[0]
-    vlen = 0
-    if (code >= 200 and code <= 219):
-        v = code - 200
-        i = 1
-    elif (code >= 8 and code <= 15):
-        vlen = code - 7
-        i = 1
-        v = di(msg[i:i+vlen])
-    return [msg[i+vlen:], v]
-
-def decode_str(msg):
-    'Decode string from msg. Return tuple of remaining msg contents and string.'
-    code = msg[0]
-    i = 1
-    if (code >= 0 and code <= 3):
-        slen = di(msg[i:i+code+1])
-        i += code + 1
-        s = msg[i:i+slen].decode()
-        i += slen
-        intern_str.append(s)
-    elif (code >= 4 and code <= 7):
-        t = di(msg[i:i+code-3])
-        i += code - 3
-        s = intern_str[t]
-    elif (code >= 100 and code <= 149):
-        s = msg[i:i+code-100].decode()
-        i += code-100
-        intern_str.append(s)
-    elif (code >= 150 and code <= 199):
-        s = intern_str[code-150]
-    else:
-        raise TypeError(f'Invalid string type: {code}')
-    return [msg[i:], s]
-
-def decode_hash(msg):
-    'Decode hash from msg. Return tuple of remaining msg contents and hash.'
-    d = {}
-    while len(msg) != 0 and msg[0] != 255:
-        msg, k = decode_str(msg)
-        msg, v = decode_value(msg)
-        d[k] = v
-    return [msg[1:], d]
-
-def decode_array(msg):
-    'Decode array from msg. Return tuple of remaining msg contents and array.'
-    a = []
-    while len(msg) != 0 and msg[0] != 255:
-        msg, v = decode_value(msg)
-        a.append(v)
-    return [msg[1:], a]
-
-def decode_value(msg):
-    'Decode value from msg. Return tuple of remaining msg contents and value.'
-    code = msg[0]
-    if code == HASH:
-        return decode_hash(msg[1:])
-    elif is_str(code):
-        return decode_str(msg)
-    elif is_int(code):
-        return decode_int(msg)
-    elif code == BOOL_FALSE:
-        return [msg[1:], False]
-    elif code == BOOL_TRUE:
-        return [msg[1:], True]
-    elif code == ARRAY:
-        return decode_array(msg[1:])
-    elif code == DATA:
-        dlen = di(msg[1:9])
-        return [msg[dlen+9:], msg[10:dlen+10]]
-    else:
-        raise TypeError(f'binapi: Unhandled type code: f{code}')
-    return [msg, None]
+class Decoder():
+    '''Decoder of a single binary API response, held in buf.
+
+    Values are decoded in place, by offset into buf, with the table of
+    strings reused within the response held by the decoder.
+    '''
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+        self.strings = []
+        return
+
+    def take(self, n):
+        'Return next n bytes of buf.'
+        self.pos += n
+        return self.buf[self.pos-n:self.pos]
+
+    def string(self, code):
+        'Decode string, whose type code has been read.'
+        if code <= 3:
+            s = self.take(di(self.take(code + 1))).decode()
+            self.strings.append(s)
+        elif code <= 7:
+            s = self.strings[di(self.take(code - 3))]
+        elif code <= 149:
+            s = self.take(code - 100).decode()
+            self.strings.append(s)
+        elif code <= 199:
+            s = self.strings[code - 150]
+        else:
+            raise TypeError(f'Invalid string type: {code}')
+        return s
+
+    def value(self):
+        'Decode next value.'
+        buf = self.buf
+        code = buf[self.pos]
+        self.pos += 1
+        if code == HASH:
+            d = {}
+            while self.pos < len(buf) and buf[self.pos] != END:
+                self.pos += 1
+                k = self.string(buf[self.pos-1])
+                d[k] = self.value()
+            self.pos += 1
+            return d
+        elif is_str(code):
+            return self.string(code)
+        elif code >= 200 and code <= 219:
+            return code - 200
+        elif code >= 8 and code <= 15:
+            return di(self.take(code - 7))
+        elif code == BOOL_FALSE:
+            return False
+        elif code == BOOL_TRUE:
+            return True
+        elif code == ARRAY:
+            a = []
+            while self.pos < len(buf) and buf[self.pos] != END:
+                a.append(self.value())
+            self.pos += 1
+            return a
+        elif code == DATA:
+            return self.take(di(self.take(8)))
+        else:
+            raise TypeError(f'binapi: Unhandled type code: {code}')
+        return
 
 def decode(msg):
     'Decode pCloud binary API response and return as dict.'
-    global intern_str
-    intern_str = []
-    _, resp = decode_value(msg)
-    return resp
+    return Decoder(msg).value()
+
+class TLSSessions():
+    '''TLS sessions of connections made, by (hostname, port), for
+       resumption.
+
+    A new connection to an address may resume the TLS session of an
+    earlier one, with an abbreviated handshake, if it uses the same SSL
+    context. Sessions last only as long as the process; the ssl module
+    provides no means of saving them.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        return
+
+    def get(self, context, address):
+        '''Return session to resume for a connection to address using
+           context, or None.'''
+        with self.lock:
+            entry = self.sessions.get(address)
+        return entry[1] if entry and entry[0] is context else None
+
+    def save(self, ssock, address):
+        '''Save the session of SSL socket ssock, connected to address,
+           if it may be resumed. With TLS 1.3, a session is resumable
+           only once its ticket has been received, after the
+           handshake, so sockets are saved after use.'''
+        session = ssock.session
+        if session is not None and session.has_ticket:
+            with self.lock:
+                self.sessions[address] = (ssock.context, session)
+        return
+
+# TLS sessions of binary API and HTTPS connections
+tls_sessions = TLSSessions()
+
+class BinarySession():
+    '''Connection to the pCloud binary API.
+
+    Each session has its own socket, byte counts and decoder state, so
+    separate sessions may be used by separate threads at once. Calls
+    on one session are serialised by its lock.
+    '''
+    def __init__(self):
+        self.sock = None
+        self.ssock = None
+        self.address = None # (hostname, port) of open socket
+        self.resumed = False # TLS session of open socket was resumed
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        return
 
-def open_socket(hostname, port, timeout=10):
+    def open(self, hostname, port, timeout=10, context=None):
+        '''Open an SSL-wrapped socket, resuming the TLS session of an
+           earlier connection with the same context, if possible.'''
+        if context is None:
+            context = ssl.create_default_context()
+        with profiler.span('connect', host=f'{hostname}:{port}') as span:
+            self.sock = socket.create_connection((hostname, port), timeout)
+            self.ssock = context.wrap_socket(
+                self.sock, server_hostname=hostname,
+                session=tls_sessions.get(context, (hostname, port)))
+            span.set(resumed=self.ssock.session_reused)
+        self.address = (hostname, port)
+        self.resumed = self.ssock.session_reused
+        return
+
+    def close(self):
+        'Close SSL socket(s), if open'
+        if self.ssock:
+            tls_sessions.save(self.ssock, self.address)
+            self.ssock.close()
+        if self.sock: self.sock.close()
+        self.ssock = self.sock = self.address = None
+        return
+
+    def closed_by_peer(self):
+        '''Return True if the socket of this idle session has been
+           closed by pCloud (or is otherwise unusable).'''
+        if not self.ssock:
+            return True
+        if not select.select([self.ssock], [], [], 0)[0]:
+            return False
+        # Readable, but perhaps only with TLS records carrying no data
+        # (e.g. TLS 1.3 session tickets, sent after the handshake). On
+        # an idle connection, any data, or end of file, means it is
+        # unusable.
+        timeout = self.ssock.gettimeout()
+        self.ssock.setblocking(False)
+        try:
+            self.ssock.recv(1)
+        except ssl.SSLWantReadError:
+            return False
+        except OSError:
+            pass
+        finally:
+            self.ssock.settimeout(timeout)
+        return True
+
+    def _recv(self, nbytes):
+        'Receive nbytes from secure socket. Fewer are returned on EOF.'
+        buf = bytearray()
+        while len(buf) < nbytes:
+            chunk = self.ssock.recv(min(nbytes - len(buf), 65536))
+            if not chunk:
+                break
+            buf += chunk
+        self.bytes_received += len(buf)
+        return bytes(buf)
+
+    def _recv_response(self):
+        'Receive a single response from secure socket and return as dict.'
+        try:
+            with profiler.span('wait'):
+                byte_length = di(self._recv(4))
+            with profiler.span('recv', bytes=byte_length):
+                response = self._recv(byte_length)
+        except TimeoutError:
+            return {'result': 9002, 'error': \
+                    'Timeout error on response from binary request'}
+        if byte_length == 0 or len(response) != byte_length:
+            return {'result': 9000, 'error': \
+                    'Null return from binary request'}
+        with profiler.span('decode', bytes=byte_length):
+            return decode(response)
+
+    def send_request(self, method, params = {}, data = b'', progress = None):
+        '''Send binary request.
+
+        data may be any bytes-like object. Large data is sent directly
+        from its buffer, in chunks of SEND_CHUNK bytes if progress is
+        provided; progress is called with the number of bytes in each
+        chunk sent.
+        '''
+        with self.lock:
+            if not self.ssock:
+                return {'result': 9001, 'error': 'Secure socket is not open'}
+            with profiler.span('encode', method=method):
+                header = encode_header(method, params, len(data))
+            with profiler.span('send', bytes=len(header) + len(data)):
+                if len(data) <= SEND_CHUNK:
+                    self.ssock.sendall(header + data)
+                    if progress and data: progress(len(data))
+                else:
+                    self.ssock.sendall(header)
+                    if progress:
+                        view = memoryview(data)
+                        for i in range(0, len(view), SEND_CHUNK):
+                            chunk = view[i:i+SEND_CHUNK]
+                            self.ssock.sendall(chunk)
+                            progress(len(chunk))
+                    else:
+                        self.ssock.sendall(data)
+            self.bytes_sent += len(header) + len(data)
+            return self._recv_response()
+
+    def send_requests(self, requests, window=PIPELINE_WINDOW):
+        '''Send binary requests, pipelined over the open socket.
+
+        requests is a sequence of (method, params, data) tuples. Up to
+        window requests are sent ahead of their responses. Returns list
+        of responses, in request order. If the connection fails, the
+        remaining responses are all set to the failure.
+        '''
+        with self.lock:
+            if not self.ssock:
+                return [{'result': 9001,
+                         'error': 'Secure socket is not open'}] * len(requests)
+            responses = []
+            inflight = 0
+            for method, params, data in requests:
+                if inflight == window:
+                    responses.append(self._recv_response())
+                    inflight -= 1
+                    if responses[-1]['result'] in (9000, 9002):
+                        break
+                with profiler.span('encode', method=method):
+                    request = encode(method, params, data)
+                with profiler.span('send', bytes=len(request)):
+                    self.ssock.sendall(request)
+                self.bytes_sent += len(request)
+                inflight += 1
+            while inflight and (not responses or
+                                responses[-1]['result'] not in (9000, 9002)):
+                responses.append(self._recv_response())
+                inflight -= 1
+            if len(responses) < len(requests):
+                responses += [responses[-1]] * (len(requests) - len(responses))
+            return responses
+
+class SessionPool():
+    '''Open sessions not in use, by address, for reuse.
+
+    get() lends a session, which the borrower returns with put() when
+    done, so each session is used by one borrower at a time.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        return
+
+    def get(self, hostname, port, timeout=10, context=None):
+        '''Return tuple of session connected to hostname and port, and
+           True if it was opened for this call. Idle sessions closed by
+           pCloud are discarded.'''
+        with self.lock:
+            sessions = self.idle.get((hostname, port), [])
+            while sessions:
+                session = sessions.pop()
+                if not session.closed_by_peer():
+                    return (session, False)
+                session.close()
+        session = BinarySession()
+        session.open(hostname, port, timeout, context)
+        return (session, True)
+
+    def put(self, session):
+        'Return session to the pool, unless it has been closed.'
+        if session.ssock:
+            tls_sessions.save(session.ssock, session.address)
+            with self.lock:
+                self.idle.setdefault(session.address, []).append(session)
+        return
+
+    def count(self):
+        'Return number of idle sessions.'
+        with self.lock:
+            return sum(len(sessions) for sessions in self.idle.values())
+
+    def close(self):
+        'Close all idle sessions.'
+        with self.lock:
+            for sessions in self.idle.values():
+                for session in sessions:
+                    session.close()
+            self.idle = {}
+        return
+
+# Sessions shared by PCloud instances
+pool = SessionPool()
+
+# The module functions below use a single session, session, as
+# binapi did before sessions were introduced.
+session = BinarySession()
+
+def __getattr__(name):
+    # the default session's state, formerly module globals
+    if name in ('sock', 'ssock', 'address', 'bytes_sent', 'bytes_received'):
+        return getattr(session, name)
+    raise AttributeError(f"module 'binapi' has no attribute '{name}'")
+
+def open_socket(hostname, port, timeout=10, context=None):
     'Open an SSL-wrapped socket'
-    global sock, ssock
-    context = ssl.create_default_context()
-    sock = socket.create_connection((hostname, port))
-    sock.settimeout(timeout)
-    ssock = context.wrap_socket(sock, server_hostname=hostname)
+    session.open(hostname, port, timeout, context)
     return
 
 def close_socket():
     'Close SSL socket(s), if open'
-    global sock, ssock
-    if ssock: ssock.close()
-    if sock: sock.close()
-    ssock = sock = None
+    session.close()
     return
 
-def send_request(method, params = {}, data = b''):
-    '''Send binary request. '''
-    global sock, ssock
-    response = b''
-    if ssock:
-        request = encode(method, params, data)
-        nsent = ssock.send(request)
-        byte_length = di(ssock.recv(4))
-        more = True
-        while more:
-            try:
-                resp = ssock.recv(2048)
-            except TimeoutError:
-                return {'result': 9002, 'error': \
-                        'Timeout error on response from binary request'}
-            nresp = len(resp)
-            if nresp == 0:
-                return {'result': 9000, 'error': \
-                        'Null return from binary request'}
-            response += resp
-            if len(response) == byte_length:
-                more = False
-    else:
-        return {'result': 9001, 'error': 'Secure socket is not open'}
-    return decode(response)
+def send_request(method, params = {}, data = b'', progress = None):
+    'Send binary request on default session. See BinarySession.'
+    return session.send_request(method, params, data, progress)
+
+def send_requests(requests, window=PIPELINE_WINDOW):
+    'Send pipelined binary requests on default session. See BinarySession.'
+    return session.send_requests(requests, window)
 
 if __name__ == "__main__":
     bytes_val = encode('method', {'int': 0, 'str': 'string', 'bool': True})
@@ -0,0 +1,169 @@
+'''
+NAME
+ daemon.py - server side of pcloudd.py
+
+DESCRIPTION
+ Provides:
+  start, running the daemon in the foreground until it is stopped
+
+ Daemon listens on the Unix domain socket of pcloudd.py, and runs the
+ command line sent by each client in-process, one at a time, sending
+ its output back as it is written. Programs are loaded on first use
+ and kept, with the pcutil.py folder cache and the connections in the
+ session pool, for later commands. See pcloudd.py.
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import socketserver
+import contextlib
+import importlib.util
+import pcloudapi
+import binapi
+import pcloudd
+
+class Output(io.TextIOBase):
+    '''Text stream sending writes to client as frames for fd.'''
+    def __init__(self, wfile, fd, tty):
+        self.wfile = wfile
+        self.fd = fd
+        self.tty = tty
+        return
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, s):
+        self.wfile.write(json.dumps({'fd': self.fd, 'data': s}).encode() +
+                         b'\n')
+        return len(s)
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        stdout = Output(self.wfile, 1, False)
+        stderr = Output(self.wfile, 2, message.get('tty', False))
+        match message.get('control'):
+            case 'stop':
+                self.server.stopping = True
+                code = 0
+            case 'status':
+                print(self.server.status(), file=stdout)
+                code = 0
+            case _:
+                code = self.server.run(message, stdout, stderr)
+        self.wfile.write(json.dumps({'exit': code}).encode() + b'\n')
+        return
+
+class Daemon(socketserver.UnixStreamServer):
+    '''Server running commands, one at a time, for clients.'''
+    def __init__(self, pcloud, path):
+        self.pcloud = pcloud
+        self.programs = {}
+        self.started = time.time()
+        self.commands = 0
+        self.stopping = False
+        super().__init__(path, Handler)
+        os.chmod(path, 0o600)
+        return
+
+    def program(self, name):
+        '''Return module of program name, loaded on first use.'''
+        if name not in self.programs:
+            # load by pathname: token.py would otherwise be the
+            # standard library token module
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                name)
+            spec = importlib.util.spec_from_file_location(name[:-3], path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.programs[name] = module
+        return self.programs[name]
+
+    def keep_warm(self):
+        '''Ensure a connection to the daemon's endpoint is open in the
+           session pool, reopening it if pCloud has closed it.'''
+        try:
+            with self.pcloud.session():
+                pass
+        except pcloudapi.PCloudException:
+            pass # the command will fail to open it too, and say so
+        return
+
+    def run(self, message, stdout, stderr):
+        '''Run command in message, with output to stdout and
+           stderr. Return exit status.'''
+        if message.get('program') not in pcloudd.PROGRAMS:
+            print(f'pcloudd.py: cannot run {message.get("program")}',
+                  file=stderr)
+            return 1
+        self.commands += 1
+        self.keep_warm()
+        os.chdir(message['cwd'])
+        os.environ['COLUMNS'] = str(message['columns'])
+        sys.argv = [message['program']] + message['argv']
+        code = 0
+        module = None
+        with contextlib.redirect_stdout(stdout), \
+             contextlib.redirect_stderr(stderr):
+            try:
+                module = self.program(message['program'])
+                module.main()
+            except SystemExit as err:
+                code = err.code
+                if isinstance(code, str):
+                    print(code, file=sys.stderr)
+                    code = 1
+            except BrokenPipeError:
+                # client has gone; its output cannot be delivered
+                code = 1
+            except Exception as err:
+                pcloudapi.error(f'pcloudd: {err!r}', die=False)
+                code = 1
+        if hasattr(module, 'end_command'):
+            module.end_command(bool(code))
+        os.chdir('/')
+        return code or 0
+
+    def status(self):
+        '''Return daemon status report.'''
+        lines = [f'pid: {os.getpid()}',
+                 f'socket: {pcloudd.socket_path()}',
+                 f'uptime: {time.time() - self.started:.0f}s',
+                 f'commands: {self.commands}',
+                 f'idle connections: {binapi.pool.count()}']
+        if pcloudapi.metrics.methods:
+            lines.append(pcloudapi.metrics.summary())
+        return '\n'.join(lines)
+
+def start(pcloud):
+    '''Run daemon in the foreground, until stopped.'''
+    path = pcloudd.socket_path()
+    if (conn := pcloudd.connect()) is not None:
+        conn.close()
+        pcloudapi.error(f'already running on {path}')
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path) # left by a daemon which did not stop cleanly
+    pcloud.authenticate()
+    # commands run here must not be forwarded back to the daemon, nor
+    # wait for input
+    os.environ['PCLOUDD'] = 'off'
+    sys.stdin = io.StringIO()
+    with Daemon(pcloud, path) as server:
+        server.keep_warm()
+        try:
+            while not server.stopping:
+                server.handle_request()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+            binapi.pool.close()
+    return
@@ -0,0 +1,147 @@
+'''
+NAME
+ filecache.py - local cache of the contents of pCloud files
+
+DESCRIPTION
+ Provides:
+  ContentCache, holding copies of downloaded pCloud files, up to a
+   total size
+  place, copying or linking a cached copy to its destination
+
+ Entries are keyed by fileid and pCloud content hash. A file changed
+ on pCloud has a new hash, so a cached copy of it is never used.
+
+ Entries are written to a temporary file and renamed into place, so
+ that no reader, in this or another process, sees a partial entry.
+ An entry's modification time records its last use; once the cache
+ holds more than its size, the least recently used entries are
+ removed. Entries are read-only, as destinations may be hard links
+ to them.
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import profiler
+
+CACHE_DIR = '~/.cache/pcloud/files'
+
+# Default size of cache, in bytes
+CACHE_SIZE = 1024**3
+
+class ContentCache():
+    '''Cache of pCloud file contents in directory, of at most size
+       bytes.'''
+    def __init__(self, directory=CACHE_DIR, size=CACHE_SIZE):
+        self.directory = os.path.expanduser(os.path.expandvars(directory))
+        self.size = size
+        self.total = None # bytes held, counted when first needed
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.hit_bytes = 0
+        return
+
+    def pathname(self, fileid, hash):
+        '''Return pathname of entry for file fileid, with hash.'''
+        return os.path.join(self.directory, f'{hash % 256:02x}',
+                            f'{fileid}-{hash:016x}')
+
+    def get(self, fileid, hash):
+        '''Return pathname of entry for file fileid, with hash, or None
+           if it is not cached. Its use is recorded.'''
+        path = self.pathname(fileid, hash)
+        try:
+            os.utime(path)
+            size = os.stat(path).st_size
+        except OSError:
+            return None
+        with self.lock:
+            self.hits += 1
+            self.hit_bytes += size
+        return path
+
+    def put(self, fileid, hash, data):
+        '''Add data, the contents of file fileid with hash, to the
+           cache, removing least recently used entries to make room.
+           Return pathname of entry, or None if it cannot be added.'''
+        if len(data) > self.size:
+            return None
+        path = self.pathname(fileid, hash)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix='.tmp-')
+            try:
+                with profiler.span('write', file=tmp), open(fd, 'wb') as f:
+                    f.write(data)
+                os.chmod(tmp, 0o444)
+                os.replace(tmp, path)
+            except OSError:
+                os.unlink(tmp)
+                raise
+        except OSError:
+            return None
+        with self.lock:
+            if self.total is None:
+                self.total = sum(size for _, size, _ in self.entries())
+            else:
+                self.total += len(data)
+            if self.total > self.size:
+                self.evict()
+        return path
+
+    def entries(self):
+        '''Return list of (mtime, size, pathname) of entries.'''
+        entries = []
+        try:
+            subdirs = list(os.scandir(self.directory))
+        except OSError:
+            return entries
+        for subdir in subdirs:
+            try:
+                with os.scandir(subdir.path) as files:
+                    for file in files:
+                        if file.name.startswith('.'):
+                            continue # being written
+                        st = file.stat()
+                        entries.append((st.st_mtime, st.st_size, file.path))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        '''Remove least recently used entries until the cache is within
+           its size. Entries are listed afresh, as other processes may
+           share the cache.'''
+        entries = sorted(self.entries())
+        self.total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total <= self.size:
+                break
+            try:
+                os.unlink(path)
+                self.total -= size
+            except OSError:
+                pass
+        return
+
+def place(path, dest, link=False):
+    '''Copy cached entry path to local file dest, or hard link dest to
+       it if link is True (falling back to a copy if a link cannot be
+       made). dest is replaced atomically.'''
+    tmp = f'{dest}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with profiler.span('write', file=dest):
+        try:
+            if link:
+                try:
+                    os.link(path, tmp)
+                except OSError:
+                    shutil.copyfile(path, tmp)
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, dest)
+        except OSError:
+            if os.path.exists(tmp): os.unlink(tmp)
+            raise
+    return
@@ -0,0 +1,801 @@
+#!/usr/bin/env python
+'''
+NAME
+  mockserver.py - local stand-in for the pCloud API
+
+SYNOPSIS
+  python mockserver.py [--host host] [--port binary-port]
+                       [--http-port http-port] [--root dir]
+                       [--cert-dir dir] [--config config-file]
+                       [--latency seconds] [--bandwidth bytes-per-second]
+                       [--error-rate rate] [--seed seed]
+
+DESCRIPTION
+  Serves the pCloud binary protocol and the JSON HTTP API (including
+  file downloads) over TLS, backed by an in-memory filesystem. The
+  filesystem may be seeded from a local directory with --root.
+
+  Latency (per request), a bandwidth cap (shared by all connections)
+  and an error rate (fraction of requests failing with pCloud error
+  5000) can be injected. Errors are drawn from a random generator
+  seeded with --seed, so runs are repeatable.
+
+  A self-signed certificate for localhost is generated with openssl
+  in --cert-dir, unless cert.pem and key.pem already exist there. If
+  --config is given, a client configuration file pointing at the
+  server is written, for use with the -f common option:
+
+    python mockserver.py --config /tmp/mock.json &
+    python pcutil.py -f /tmp/mock.json cp file p:/
+
+  The MockServer class may also be used directly, e.g. by bench.py.
+'''
+
+import sys
+import os
+import io
+import json
+import time
+import random
+import hashlib
+import getopt
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import zipfile
+import urllib.parse
+import http.server
+import pcloudapi
+
+# Binary interface types, as binapi
+HASH = 16
+ARRAY = 17
+BOOL_FALSE = 18
+BOOL_TRUE = 19
+
+CHUNK_SIZE = 65536
+
+class MockError(Exception):
+    '''pCloud API error, returned to the client as result and error.'''
+    def __init__(self, code, msg):
+        self.code = code
+        self.msg = msg
+        return
+
+def encode_value(value):
+    'Encode python value in pCloud binary response format.'
+    if isinstance(value, bool):
+        return bytes([BOOL_TRUE if value else BOOL_FALSE])
+    elif isinstance(value, int):
+        if 0 <= value < 20:
+            return bytes([200 + value])
+        return bytes([15]) + value.to_bytes(8, 'little')
+    elif isinstance(value, str):
+        b = value.encode()
+        if len(b) < 50:
+            return bytes([100 + len(b)]) + b
+        return bytes([3]) + len(b).to_bytes(4, 'little') + b
+    elif isinstance(value, dict):
+        return bytes([HASH]) + \
+            b''.join(encode_value(k) + encode_value(v)
+                     for k, v in value.items()) + b'\xff'
+    elif isinstance(value, (list, tuple)):
+        return bytes([ARRAY]) + \
+            b''.join(encode_value(v) for v in value) + b'\xff'
+    raise TypeError(f'mockserver: cannot encode: {type(value)}')
+
+def encode_response(value):
+    'Encode value as a complete binary response, with length prefix.'
+    body = encode_value(value)
+    return len(body).to_bytes(4, 'little') + body
+
+def decode_request(msg):
+    '''Decode binary request msg (excluding the 2 byte length).
+
+    Returns tuple of method, params dict and length of data following
+    the request.
+    '''
+    method_len = msg[0]
+    i = 1
+    data_len = 0
+    if method_len & (1 << 7):
+        method_len &= 0x7f
+        data_len = int.from_bytes(msg[i:i+8], 'little')
+        i += 8
+    method = msg[i:i+method_len].decode()
+    i += method_len
+    nparams = msg[i]
+    i += 1
+    params = {}
+    for _ in range(nparams):
+        code, name_len = msg[i] >> 6, msg[i] & 0x3f
+        name = msg[i+1:i+1+name_len].decode()
+        i += 1 + name_len
+        match code:
+            case 0:
+                vlen = int.from_bytes(msg[i:i+4], 'little')
+                params[name] = msg[i+4:i+4+vlen].decode()
+                i += 4 + vlen
+            case 1:
+                params[name] = int.from_bytes(msg[i:i+8], 'little')
+                i += 8
+            case 2:
+                params[name] = bool(msg[i])
+                i += 1
+    return (method, params, data_len)
+
+def make_cert(cert_dir):
+    '''Return (certfile, keyfile) for a self-signed localhost certificate
+       in cert_dir, creating them with openssl if required.'''
+    certfile = os.path.join(cert_dir, 'cert.pem')
+    keyfile = os.path.join(cert_dir, 'key.pem')
+    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
+        os.makedirs(cert_dir, exist_ok=True)
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                        '-nodes', '-days', '3650', '-subj', '/CN=localhost',
+                        '-addext', 'subjectAltName=DNS:localhost,'
+                        'IP:127.0.0.1', '-keyout', keyfile, '-out', certfile],
+                       check=True, capture_output=True)
+    return (certfile, keyfile)
+
+class Node():
+    '''File or folder in the mock filesystem.'''
+    def __init__(self, id, name, parent, isfolder, data=b''):
+        self.id = id
+        self.name = name
+        self.parent = parent
+        self.isfolder = isfolder
+        self.contents = {} if isfolder else None
+        self.created = self.modified = time.time()
+        self.set_data(data)
+        return
+
+    def set_data(self, data):
+        self.data = bytes(data)
+        self.hash = int.from_bytes(
+            hashlib.sha1(self.data).digest()[:8], 'little')
+        self.modified = time.time()
+        return
+
+    def path(self):
+        names = []
+        node = self
+        while node.parent:
+            names.append(node.name)
+            node = node.parent
+        return '/' + '/'.join(reversed(names))
+
+    def metadata(self, recursive=False, nofiles=False, contents=False):
+        fmt = '%a, %d %b %Y %H:%M:%S +0000'
+        meta = {'name': self.name or '/',
+                'isfolder': self.isfolder,
+                'id': ('d' if self.isfolder else 'f') + str(self.id),
+                'parentfolderid': self.parent.id if self.parent else 0,
+                'created': time.strftime(fmt, time.gmtime(self.created)),
+                'modified': time.strftime(fmt, time.gmtime(self.modified))}
+        if self.isfolder:
+            meta['folderid'] = self.id
+            if contents:
+                meta['contents'] = [
+                    node.metadata(recursive, nofiles, recursive)
+                    for node in self.contents.values()
+                    if node.isfolder or not nofiles]
+        else:
+            meta['fileid'] = self.id
+            meta['size'] = len(self.data)
+            meta['hash'] = self.hash
+        return meta
+
+class MockFS():
+    '''In-memory filesystem implementing the pCloud API methods.'''
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.root = Node(0, '', None, True)
+        self.folders = {0: self.root}
+        self.files = {}
+        self.uploads = {}
+        self.collections = {}
+        self.tokens = {1: {'tokenid': 1, 'device': 'mockserver',
+                           'expires': 'Thu, 01 Jan 2099 00:00:00 +0000'}}
+        self.next_id = 1
+        return
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def load(self, directory):
+        '''Copy the contents of local directory into the filesystem.'''
+        for root, dirs, files in os.walk(directory):
+            rel = os.path.relpath(root, directory)
+            folder = self.root if rel == '.' else \
+                self.make_folders('/' + rel)
+            for file in files:
+                with open(os.path.join(root, file), 'rb') as f:
+                    self.add_file(folder, file, f.read())
+        return
+
+    def lookup(self, path):
+        node = self.root
+        for name in path.split('/'):
+            if not name: continue
+            if not node.isfolder:
+                raise MockError(2002, 'A component of parent directory '
+                                'does not exist.')
+            if name not in node.contents:
+                return None
+            node = node.contents[name]
+        return node
+
+    def make_folders(self, path):
+        node = self.root
+        for name in path.split('/'):
+            if name:
+                node = node.contents.get(name) or \
+                    self.add_folder(node, name)
+        return node
+
+    def add_folder(self, parent, name):
+        if name in parent.contents:
+            raise MockError(2004, 'File or folder alredy exists.')
+        node = Node(self._new_id(), name, parent, True)
+        parent.contents[name] = self.folders[node.id] = node
+        return node
+
+    def add_file(self, parent, name, data):
+        node = parent.contents.get(name)
+        if node and node.isfolder:
+            raise MockError(2004, 'File or folder alredy exists.')
+        if node:
+            node.set_data(data)
+        else:
+            node = Node(self._new_id(), name, parent, False, data)
+            parent.contents[name] = self.files[node.id] = node
+        return node
+
+    def remove(self, node):
+        '''Remove node (and anything below it). Returns tuple of number
+           of files and folders removed.'''
+        nfiles = nfolders = 0
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n.isfolder:
+                nfolders += 1
+                stack += n.contents.values()
+                self.folders.pop(n.id, None)
+            else:
+                nfiles += 1
+                self.files.pop(n.id, None)
+        del node.parent.contents[node.name]
+        return (nfiles, nfolders)
+
+    def folder(self, params, id_key='folderid', path_key='path'):
+        if id_key in params:
+            node = self.folders.get(int(params[id_key]))
+        elif path_key in params:
+            node = self.lookup(params[path_key])
+            if node and not node.isfolder: node = None
+        else:
+            raise MockError(1002, 'No full path or folderid provided.')
+        if node is None:
+            raise MockError(2005, 'Directory does not exist.')
+        return node
+
+    def file(self, params):
+        if 'fileid' in params:
+            node = self.files.get(int(params['fileid']))
+        elif 'path' in params:
+            node = self.lookup(params['path'])
+            if node and node.isfolder: node = None
+        else:
+            raise MockError(1004, 'No fileid or path provided.')
+        if node is None:
+            raise MockError(2009, 'File not found.')
+        return node
+
+    def target(self, params, name):
+        '''Return destination folder and name for copy/rename calls.'''
+        if 'topath' in params:
+            topath = params['topath']
+            if topath.endswith('/'):
+                return (self.folder({'path': topath}), name)
+            folder, name = os.path.split(topath)
+            return (self.folder({'path': folder or '/'}), name)
+        return (self.folder(params, 'tofolderid', 'topath'),
+                params.get('toname', name))
+
+    def copy_node(self, node, parent, name, noover=False, skip=False):
+        if node.isfolder:
+            folder = parent.contents.get(name)
+            if folder is None:
+                folder = self.add_folder(parent, name)
+            elif not folder.isfolder:
+                raise MockError(2004, 'File or folder alredy exists.')
+            for child in list(node.contents.values()):
+                self.copy_node(child, folder, child.name, noover, skip)
+            return folder
+        if name in parent.contents:
+            if skip: return parent.contents[name]
+            if noover:
+                raise MockError(2004, 'File or folder alredy exists.')
+        return self.add_file(parent, name, node.data)
+
+    def call(self, method, params, data, host):
+        '''Execute API method. Returns response dict.'''
+        handler = getattr(self, 'm_' + method, None)
+        if handler is None:
+            return {'result': 2000, 'error': 'Invalid method.'}
+        if method not in ('getdigest', 'userinfo', 'getapiserver') and \
+           not (params.get('access_token') or params.get('auth')):
+            return {'result': 1000, 'error': 'Log in required.'}
+        try:
+            with self.lock:
+                response = handler(params, data, host)
+        except MockError as err:
+            return {'result': err.code, 'error': err.msg}
+        except (KeyError, ValueError) as err:
+            return {'result': 1001, 'error': f'Invalid parameter: {err}'}
+        return dict(result=0, **response)
+
+    # API methods; each returns response dict, without result
+
+    def m_stat(self, params, data, host):
+        if 'fileid' in params:
+            node = self.file(params)
+        elif 'folderid' in params:
+            node = self.folder(params)
+        else:
+            node = self.lookup(params['path'])
+        if node is None:
+            raise MockError(2009, 'File not found.')
+        return {'metadata': node.metadata()}
+
+    def m_listfolder(self, params, data, host):
+        node = self.folder(params)
+        meta = node.metadata(bool(int(params.get('recursive', 0))),
+                             bool(int(params.get('nofiles', 0))), True)
+        meta['path'] = node.path()
+        return {'metadata': meta}
+
+    def m_createfolder(self, params, data, host):
+        if 'name' in params:
+            parent, name = self.folder(params), params['name']
+        else:
+            folder, name = os.path.split(params['path'])
+            parent = self.folder({'path': folder or '/'})
+        return {'metadata': self.add_folder(parent, name).metadata()}
+
+    def m_createfolderifnotexists(self, params, data, host):
+        try:
+            return self.m_createfolder(params, data, host)
+        except MockError as err:
+            if err.code != 2004: raise
+        if 'name' in params:
+            node = self.folder(params).contents[params['name']]
+        else:
+            node = self.lookup(params['path'])
+        if not node.isfolder: raise MockError(2004, 'File or folder '
+                                              'alredy exists.')
+        return {'metadata': node.metadata()}
+
+    def m_uploadfile(self, params, data, host):
+        node = self.add_file(self.folder(params), params['filename'], data)
+        return {'metadata': [node.metadata()], 'fileids': [node.id],
+                'checksums': [{'sha1': hashlib.sha1(data).hexdigest(),
+                               'sha256': hashlib.sha256(data).hexdigest()}]}
+
+    def upload(self, params):
+        uploadid = int(params['uploadid'])
+        if uploadid not in self.uploads:
+            raise MockError(1900, 'Invalid uploadid.')
+        return uploadid
+
+    def m_upload_create(self, params, data, host):
+        uploadid = self._new_id()
+        self.uploads[uploadid] = bytearray()
+        return {'uploadid': uploadid}
+
+    def m_upload_write(self, params, data, host):
+        buf = self.uploads[self.upload(params)]
+        offset = int(params['uploadoffset'])
+        if offset > len(buf):
+            raise MockError(1901, 'Invalid uploadoffset.')
+        buf[offset:offset+len(data)] = data
+        return {}
+
+    def m_upload_save(self, params, data, host):
+        uploadid = self.upload(params)
+        node = self.add_file(self.folder(params), params['name'],
+                             self.uploads.pop(uploadid))
+        return {'metadata': node.metadata()}
+
+    def m_getfilelink(self, params, data, host):
+        node = self.file(params)
+        return {'hosts': [host], 'expires': '',
+                'path': f'/dl/{node.id}/{urllib.parse.quote(node.name)}'}
+
+    def m_getziplink(self, params, data, host):
+        node = self.folder(params)
+        return {'hosts': [host], 'expires': '',
+                'path': f'/zip/{node.id}/'
+                f'{urllib.parse.quote(node.name or "pcloud")}.zip'}
+
+    def zip(self, node):
+        '''Return zip archive of folder node and its contents, below a
+           folder of its name (but not for the root folder). It is
+           written as if to a stream, with data descriptors, as
+           pCloud's are.'''
+        class Stream(io.RawIOBase):
+            def __init__(self):
+                self.buf = bytearray()
+            def writable(self):
+                return True
+            def write(self, b):
+                self.buf += b
+                return len(b)
+        out = Stream()
+        with zipfile.ZipFile(out, 'w') as archive:
+            stack = [(node, node.name + '/' if node.parent else '')]
+            while stack:
+                folder, prefix = stack.pop()
+                if prefix: archive.writestr(prefix, b'')
+                for child in folder.contents.values():
+                    if child.isfolder:
+                        stack.append((child, f'{prefix}{child.name}/'))
+                    else:
+                        archive.writestr(prefix + child.name, child.data)
+        return bytes(out.buf)
+
+    def m_checksumfile(self, params, data, host):
+        node = self.file(params)
+        return {'metadata': node.metadata(),
+                'sha1': hashlib.sha1(node.data).hexdigest(),
+                'sha256': hashlib.sha256(node.data).hexdigest()}
+
+    def m_deletefile(self, params, data, host):
+        node = self.file(params)
+        meta = node.metadata()
+        self.remove(node)
+        meta['isdeleted'] = True
+        return {'metadata': meta}
+
+    def m_deletefolder(self, params, data, host):
+        node = self.folder(params)
+        if node is self.root:
+            raise MockError(2003, 'Access denied.')
+        if node.contents:
+            raise MockError(2006, 'Folder is not empty.')
+        meta = node.metadata()
+        self.remove(node)
+        meta['isdeleted'] = True
+        return {'metadata': meta}
+
+    def m_deletefolderrecursive(self, params, data, host):
+        node = self.folder(params)
+        if node is self.root:
+            raise MockError(2003, 'Access denied.')
+        nfiles, nfolders = self.remove(node)
+        return {'deletedfiles': nfiles, 'deletedfolders': nfolders}
+
+    def m_copyfile(self, params, data, host):
+        node = self.file(params)
+        parent, name = self.target(params, node.name)
+        copy = self.copy_node(node, parent, name,
+                              bool(int(params.get('noover', 0))))
+        return {'metadata': copy.metadata()}
+
+    def m_copyfolder(self, params, data, host):
+        node = self.folder(params)
+        parent = self.folder(params, 'tofolderid', 'topath')
+        noover = bool(int(params.get('noover', 0)))
+        skip = bool(int(params.get('skipexisting', 0)))
+        if int(params.get('copycontentonly', 0)):
+            for child in list(node.contents.values()):
+                self.copy_node(child, parent, child.name, noover, skip)
+            return {'metadata': parent.metadata(contents=True)}
+        copy = self.copy_node(node, parent, node.name, noover, skip)
+        return {'metadata': copy.metadata(contents=True)}
+
+    def _rename(self, node, params):
+        parent, name = self.target(params, node.name)
+        existing = parent.contents.get(name)
+        if existing is node:
+            return {'metadata': node.metadata()}
+        if existing:
+            if existing.isfolder or node.isfolder:
+                raise MockError(2004, 'File or folder alredy exists.')
+            self.remove(existing)
+        folder = parent
+        while folder:
+            if folder is node:
+                raise MockError(2043, 'Cannot move a folder to a '
+                                'subfolder of itself.')
+            folder = folder.parent
+        del node.parent.contents[node.name]
+        node.parent, node.name = parent, name
+        parent.contents[name] = node
+        return {'metadata': node.metadata()}
+
+    def m_renamefile(self, params, data, host):
+        return self._rename(self.file(params), params)
+
+    def m_renamefolder(self, params, data, host):
+        return self._rename(self.folder(params), params)
+
+    def m_collection_list(self, params, data, host):
+        return {'collections': [{'id': id, 'name': c['name'], 'type': 1,
+                                 'items': len(c['fileids'])}
+                                for id, c in self.collections.items()]}
+
+    def _fileids(self, params):
+        ids = [int(id) for id in str(params.get('fileids', '')).split(',')
+               if id]
+        for id in ids:
+            if id not in self.files: raise MockError(2009, 'File not found.')
+        return ids
+
+    def m_collection_create(self, params, data, host):
+        id = self._new_id()
+        self.collections[id] = {'name': params['name'],
+                                'fileids': self._fileids(params)}
+        return {'collection': {'id': id, 'name': params['name'], 'type': 1}}
+
+    def m_collection_linkfiles(self, params, data, host):
+        coll = self.collections.get(int(params['collectionid']))
+        if coll is None:
+            raise MockError(2094, 'Collection not found.')
+        ids = self._fileids(params)
+        coll['fileids'] += ids
+        return {'linkedfiles': len(ids)}
+
+    def m_collection_delete(self, params, data, host):
+        if self.collections.pop(int(params['collectionid']), None) is None:
+            raise MockError(2094, 'Collection not found.')
+        return {}
+
+    def m_listtokens(self, params, data, host):
+        return {'tokens': list(self.tokens.values())}
+
+    def m_deletetoken(self, params, data, host):
+        if self.tokens.pop(int(params['tokenid']), None) is None:
+            raise MockError(2102, 'Token not found.')
+        return {}
+
+    def m_getdigest(self, params, data, host):
+        return {'digest': hashlib.sha1(os.urandom(16)).hexdigest(),
+                'expires': ''}
+
+    def m_userinfo(self, params, data, host):
+        return {'auth': 'mock', 'email': params.get('username', ''),
+                'userid': 1}
+
+    def m_getapiserver(self, params, data, host):
+        # binary API servers are named without port, which the client
+        # knows; both names are in the certificate
+        return {'api': [host], 'binapi': ['localhost',
+                                          host.rsplit(':', 1)[0]]}
+
+class Throttle():
+    '''Shared bandwidth cap. Callers sleep long enough that the total
+       rate of all callers does not exceed bandwidth bytes/second.'''
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.next = 0.0
+        return
+
+    def __call__(self, nbytes):
+        if not self.bandwidth: return
+        with self.lock:
+            now = time.monotonic()
+            self.next = max(self.next, now) + nbytes / self.bandwidth
+            delay = self.next - now
+        time.sleep(delay)
+        return
+
+class BinaryHandler(socketserver.StreamRequestHandler):
+    '''Serves binary protocol requests on a TLS connection.'''
+    def read(self, nbytes):
+        buf = bytearray()
+        while len(buf) < nbytes:
+            chunk = self.rfile.read(min(CHUNK_SIZE, nbytes - len(buf)))
+            if not chunk: raise EOFError
+            self.server.mock.throttle(len(chunk))
+            buf += chunk
+        return bytes(buf)
+
+    def handle(self):
+        mock = self.server.mock
+        host = f'{self.server.server_address[0]}:{mock.http_port}'
+        try:
+            while True:
+                header = self.rfile.read(2)
+                if len(header) < 2: break
+                msg = self.read(int.from_bytes(header, 'little'))
+                method, params, data_len = decode_request(msg)
+                data = self.read(data_len) if data_len else b''
+                response = mock.call(method, params, data, host)
+                body = encode_response(response)
+                for i in range(0, len(body), CHUNK_SIZE):
+                    mock.throttle(min(CHUNK_SIZE, len(body) - i))
+                    self.wfile.write(body[i:i+CHUNK_SIZE])
+                self.wfile.flush()
+        except (EOFError, ConnectionError, ssl.SSLError):
+            pass
+        return
+
+class HTTPHandler(http.server.BaseHTTPRequestHandler):
+    '''Serves JSON API calls and file downloads.'''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), CHUNK_SIZE):
+            self.server.mock.throttle(min(CHUNK_SIZE, len(body) - i))
+            self.wfile.write(body[i:i+CHUNK_SIZE])
+        return
+
+    def do_GET(self, form=None):
+        mock = self.server.mock
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if form: params.update(urllib.parse.parse_qsl(form))
+        if url.path.startswith('/dl/'):
+            fileid = int(url.path.split('/')[2])
+            with mock.fs.lock:
+                node = mock.fs.files.get(fileid)
+            if node is None:
+                self.send_error(404)
+            else:
+                mock.delay()
+                self.send_body(node.data, 'application/octet-stream')
+            return
+        if url.path.startswith('/zip/'):
+            folderid = int(url.path.split('/')[2])
+            with mock.fs.lock:
+                node = mock.fs.folders.get(folderid)
+                body = node and mock.fs.zip(node)
+            if node is None:
+                self.send_error(404)
+            else:
+                mock.delay()
+                self.send_body(body, 'application/zip')
+            return
+        response = mock.call(url.path.strip('/'), params, b'',
+                             f'{self.server.server_address[0]}:'
+                             f'{mock.http_port}')
+        self.send_body(json.dumps(response).encode(), 'application/json')
+        return
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = self.rfile.read(length).decode() if length else ''
+        self.do_GET(form)
+        return
+
+class _BinaryServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return (self.context.wrap_socket(sock, server_side=True), addr)
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return (self.context.wrap_socket(sock, server_side=True), addr)
+
+class MockServer():
+    '''Mock pCloud server, serving binary and HTTP APIs from threads.
+
+    Port numbers of 0 select free ports; the ports in use are
+    available as port and http_port once start() has been called.
+    '''
+    def __init__(self, host='127.0.0.1', port=0, http_port=0, cert_dir=None,
+                 latency=0.0, bandwidth=0, error_rate=0.0, seed=0):
+        self.host = host
+        self.port = port
+        self.http_port = http_port
+        self.cert_dir = cert_dir or \
+            os.path.join(tempfile.gettempdir(), 'pcloud-mockserver')
+        self.latency = latency
+        self.throttle = Throttle(bandwidth)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.fs = MockFS()
+        self.servers = []
+        return
+
+    def delay(self):
+        if self.latency: time.sleep(self.latency)
+        return
+
+    def call(self, method, params, data, host):
+        '''Execute API call, with injected latency and errors.'''
+        self.delay()
+        if self.error_rate and self.random.random() < self.error_rate:
+            return {'result': 5000, 'error': 'Internal error. Try again '
+                    'later.'}
+        return self.fs.call(method, params, data, host)
+
+    def start(self):
+        self.certfile, keyfile = make_cert(self.cert_dir)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(self.certfile, keyfile)
+        binary = _BinaryServer((self.host, self.port), BinaryHandler)
+        web = _HTTPServer((self.host, self.http_port), HTTPHandler)
+        for server in (binary, web):
+            server.context = context
+            server.mock = self
+            threading.Thread(target=server.serve_forever,
+                             daemon=True).start()
+            self.servers.append(server)
+        self.port = binary.server_address[1]
+        self.http_port = web.server_address[1]
+        return
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        return
+
+    def config(self):
+        '''Return client configuration options for this server.'''
+        return {pcloudapi.Key.ENDPOINT: f'https://{self.host}:'
+                f'{self.http_port}',
+                pcloudapi.Key.BINARY_API_PORT: self.port,
+                pcloudapi.Key.CA_FILE: self.certfile,
+                pcloudapi.Key.TOKEN: 'mock'}
+
+def main():
+    server_opts = {'host': '127.0.0.1', 'port': 8399, 'http-port': 8443,
+                   'root': '', 'cert-dir': '', 'config': '', 'latency': 0.0,
+                   'bandwidth': 0, 'error-rate': 0.0, 'seed': 0}
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '',
+                                   [opt+'=' for opt in server_opts])
+        for o, v in opts:
+            default = server_opts[o[2:]]
+            server_opts[o[2:]] = type(default)(v)
+    except (getopt.GetoptError, ValueError) as err:
+        pcloudapi.error(err)
+
+    server = MockServer(server_opts['host'], server_opts['port'],
+                        server_opts['http-port'], server_opts['cert-dir'],
+                        server_opts['latency'], server_opts['bandwidth'],
+                        server_opts['error-rate'], server_opts['seed'])
+    if server_opts['root']:
+        server.fs.load(os.path.expanduser(server_opts['root']))
+    server.start()
+    if server_opts['config']:
+        pcloudapi.save_json(server.config(), server_opts['config'],
+                            indent='  ')
+    print(f'mockserver: binary api on port {server.port}, '
+          f'http api on port {server.http_port}', file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return
+
+if __name__ == '__main__':
+    main()
@@ -13,37 +13,67 @@ TBD
 '''
 
 import urllib.parse
-import urllib.request
 import json
+import atexit
+import bisect
+import threading
 import sys
 import os
-import getpass
 import time
 import copy
 import getopt
-import http
-import platform
+import contextlib
 import socket
-import hashlib
-import webbrowser
+import ssl
 import binapi
-import traceback
+import profiler
+
+# Modules only needed by some commands (urllib.request, webbrowser,
+# platform, traceback) are imported where used, to keep start-up fast
+# for short-lived commands.
 
 DEBUG = False
 
 class Key():
     AUTH = 'auth'
+    AUTO_ENDPOINT = 'auto-endpoint'
+    CA_FILE = 'ca-file'
     CLIENT_ID = 'client-id'
     CONFIG_FILE = 'config-file'
     ENDPOINT = 'endpoint'
     EXPIRES = 'expires'
+    PROFILE = 'profile'
     REAUTH = 'reauth'
+    STATS = 'stats'
+    STATS_FILE = 'stats-file'
     TIMEOUT = 'timeout'
     TOKEN = 'access-token'
     USERNAME = 'username'
     VERBOSE = 'verbose'
     BINARY_API_PORT = 'binary-api-port'
 
+# Binary API servers found for each endpoint, in the configuration
+# file's directory; see PCloud.binary_hosts
+ENDPOINT_CACHE = 'pcloud-endpoints.json'
+
+# Seconds for which binary API servers found are used before they are
+# found again
+ENDPOINT_TTL = 12 * 3600
+
+# Binary API methods which may safely be sent again, on a new
+# connection, if the connection fails before their response arrives
+IDEMPOTENT = ('stat', 'listfolder', 'checksumfile', 'getfilelink',
+              'getziplink', 'userinfo', 'getapiserver', 'getdigest')
+
+# Largest body of a POST request sent. HTTPS POST bodies have no such
+# limit, and pCloud documents none; this is a conservative assumption,
+# the limit on the length of a binary protocol request (2 bytes)
+MAX_POST = 65535
+
+# Part of MAX_POST set aside for the parameters of a collection call
+# other than its fileids
+POST_RESERVE = 4096
+
 class PCloudException(Exception):
     '''Exception class for pCloud class. '''
     def __init__(self, url, code, msg):
@@ -95,10 +125,59 @@ class PCloud:
 
         self.config = config
         self.auth = self.config[Key.TOKEN]
-        self.headers = {'User-Agent': f'hydrus/{platform.uname().node}'}
+        self._headers = None
+        self._binary_hosts = None
+        self._hosts_lock = threading.Lock() # for cp -r workers
         return
 
-    def _request(self, action, endpoint=''):
+    @property
+    def headers(self):
+        '''HTTP request headers, created on first use.'''
+        if self._headers is None:
+            import platform
+            self._headers = {'User-Agent': f'hydrus/{platform.uname().node}'}
+        return self._headers
+
+    def ssl_context(self):
+        '''Return SSL context for connections to pCloud.
+
+        Certificates are verified against the ca-file configuration
+        option, if set (e.g. for mockserver.py), otherwise against the
+        system defaults. The context is shared with other PCloud
+        instances using the same ca-file, so that their connections
+        may resume each other's TLS sessions.
+        '''
+        return ssl_context(self.config.get(Key.CA_FILE) or None)
+
+    def _request(self, action, endpoint='', params=None):
+        '''Send JSON API request action, a method and query string. If
+           params, a dict, is given, they are sent as the body of a
+           POST, which is not bound by the length of a URL.'''
+        start = time.perf_counter()
+        result = 0
+        received = 0
+        body = None
+        if params is not None:
+            body = urllib.parse.urlencode(params, safe=',').encode()
+        try:
+            with profiler.span(action.split('?', 1)[0]):
+                payload, received = self._json_request(action, endpoint,
+                                                       body)
+        except PCloudException as err:
+            result = err.code
+            raise
+        finally:
+            metrics.record(action.split('?', 1)[0],
+                           time.perf_counter() - start,
+                           len(action) + len(body or b''), received, result)
+        return payload
+
+    def _json_request(self, action, endpoint, body=None):
+        '''Send JSON API request, with body, if given, as POST
+           data. Returns tuple of response payload and response
+           length.'''
+        import urllib.request
+        import http.client
         result = 0
         payload = None
         try:
@@ -106,8 +185,10 @@ class PCloud:
                 url = f'{self.config[Key.ENDPOINT]}/{action}'
             else:
                 url = f'{endpoint}/{action}'
-            req = urllib.request.Request(url, headers=self.headers)
-            resp = urllib.request.urlopen(req, timeout=self.config[Key.TIMEOUT])
+            req = urllib.request.Request(url, data=body,
+                                         headers=self.headers)
+            resp = _opener(self.ssl_context()).open(
+                req, timeout=self.config[Key.TIMEOUT])
             resp_text = resp.read().decode('utf-8')
             payload = json.loads(resp_text)
             result = payload['result']
@@ -116,7 +197,7 @@ class PCloud:
         except urllib.error.HTTPError as err:
             raise PCloudException(url, err.code, 'http request failed')
         except urllib.error.URLError as err:
-            if isinstance(err.reason, socket.timeout):
+            if isinstance(err.reason, TimeoutError):
                 raise PCloudException(url, 9010, 'endpoint request timed out')
             else:
                 raise PCloudException(url, 9011, err)
@@ -127,7 +208,7 @@ class PCloud:
         except http.client.RemoteDisconnected as err:
             # if URL string too long?
             raise PCloudException(url, 9014, err)
-        return payload
+        return (payload, len(resp_text))
 
     def userinfo(self, username, password, code):
         request = f'userinfo?code={code}&'\
@@ -147,20 +228,19 @@ class PCloud:
         return self._request(request)
 
     def collection_create(self, name, ids):
-        request = f'collection_create?access_token={self.auth}&name={name}&'\
-            'fileids='
-        for id in ids:
-            request = request + f'{id},'
-        request = request[:-1]
-        return self._request(request)
+        '''Create collection name, of the files in list ids. The
+           fileids are sent by POST; see max_fileids.'''
+        return self._request('collection_create',
+                             params={'access_token': self.auth,
+                                     'name': name,
+                                     'fileids': ','.join(map(str, ids))})
 
     def collection_linkfiles(self, coll_id, file_ids):
-        request = f'collection_linkfiles?access_token={self.auth}&'\
-            f'collectionid={coll_id}&fileids='
-        for id in file_ids:
-            request = request + f'{id},'
-        request = request[:-1]
-        return self._request(request)
+        '''Add the files in list file_ids to collection coll_id.'''
+        return self._request('collection_linkfiles',
+                             params={'access_token': self.auth,
+                                     'collectionid': coll_id,
+                                     'fileids': ','.join(map(str, file_ids))})
 
     def list_folder(self, path='/', recursive=1):
         request = f'listfolder?access_token={self.auth}&path={path}&'\
@@ -190,33 +270,185 @@ class PCloud:
         payload = self._request(request)
         return payload
 
-    def binary_request(self, method, params = {}, data = b''):
-        if data and not isinstance(data, bytes):
-            data = data.encode()
-        close_sock = False
-        if not binapi.ssock:
-            close_sock = True
+    @contextlib.contextmanager
+    def session(self):
+        '''Context manager lending a binary API session to the endpoint,
+           from binapi.pool.
+
+        The session is returned to the pool for reuse by later calls,
+        from this or other PCloud instances, unless its connection
+        failed. Each thread making calls at once borrows its own
+        session.
+        '''
+        hosts = self.binary_hosts()
+        for i, (hostname, port) in enumerate(hosts):
             try:
-                hostname = self.config[Key.ENDPOINT].replace('https://','')
-                binapi.open_socket(hostname,
-                                   self.config[Key.BINARY_API_PORT],
-                                   self.config[Key.TIMEOUT]*5)
+                session, opened = binapi.pool.get(
+                    hostname, port, self.config[Key.TIMEOUT]*5,
+                    self.ssl_context())
+                break
             except Exception as e:
-                raise PCloudException(self.config[Key.ENDPOINT], 9015,
-                                      'unable to open binary api endpoint')
+                metrics.record('open', 0, 0, 0, 9015)
+                if i == len(hosts) - 1:
+                    raise PCloudException(self.config[Key.ENDPOINT], 9015,
+                                          'unable to open binary api endpoint')
+                # fail over to the next server, trying this one last
+                # from now on
+                with metrics.lock:
+                    metrics.retries += 1
+                self._demote_host((hostname, port))
+        if opened:
+            with metrics.lock:
+                metrics.connections += 1
+                metrics.resumed += session.resumed
+        try:
+            yield session
+        except BaseException:
+            # the state of the connection is unknown
+            session.close()
+            raise
+        binapi.pool.put(session)
+        return
+
+    def binary_hosts(self):
+        '''Return list of (hostname, port) of binary API servers, in the
+           order in which they are to be tried.
+
+        Unless the auto-endpoint configuration option is false, the
+        servers are those reported by getapiserver for the endpoint,
+        with the endpoint's own host, ordered by the time taken to
+        connect to each; servers which cannot be reached are last. The
+        list is cached in ENDPOINT_CACHE for ENDPOINT_TTL seconds.
+        '''
+        with self._hosts_lock:
+            if self._binary_hosts is None:
+                self._binary_hosts = self._find_binary_hosts()
+            return list(self._binary_hosts)
+
+    def _find_binary_hosts(self):
+        '''Return list of binary API servers, as binary_hosts.'''
+        endpoint = self.config[Key.ENDPOINT]
+        port = self.config[Key.BINARY_API_PORT]
+        default = [(urllib.parse.urlsplit(endpoint).hostname, port)]
+        if not self.config.get(Key.AUTO_ENDPOINT, True):
+            return default
+        entry = _load_endpoint_cache(self.config).get(endpoint, {})
+        if entry.get('port') == port and entry.get('expires', 0) > time.time():
+            return [tuple(host) for host in entry['binapi']]
+        try:
+            servers = self._request('getapiserver')['binapi']
+        except PCloudException:
+            return default # try again next run
+        candidates = list(dict.fromkeys(
+            [_split_host(server, port) for server in servers] + default))
+        hosts = probe(candidates, self.config[Key.TIMEOUT])
+        hosts += [host for host in candidates if host not in hosts]
+        if self.config[Key.VERBOSE]:
+            print(f'binary api servers: '
+                  f'{", ".join(f"{h}:{p}" for h, p in hosts)}',
+                  file=sys.stderr)
+        self._save_binary_hosts(hosts)
+        return hosts
+
+    def _demote_host(self, host):
+        '''Move binary API server host to the end of the list, so that
+           it is tried last from now on.'''
+        with self._hosts_lock:
+            if host in self._binary_hosts:
+                self._binary_hosts.remove(host)
+                self._binary_hosts.append(host)
+                self._save_binary_hosts(self._binary_hosts)
+        return
+
+    def _save_binary_hosts(self, hosts):
+        '''Cache hosts as the binary API servers of the endpoint.'''
+        if not self.config.get(Key.AUTO_ENDPOINT, True):
+            return
+        cache = _load_endpoint_cache(self.config)
+        cache[self.config[Key.ENDPOINT]] = {
+            'port': self.config[Key.BINARY_API_PORT], 'binapi': hosts,
+            'expires': time.time() + ENDPOINT_TTL}
+        try:
+            save_json(cache, _endpoint_cache_file(self.config))
+        except OSError:
+            pass # found again by the next run
+        return
+
+    def binary_request(self, method, params = {}, data = b'', progress=None):
+        if isinstance(data, str):
+            data = data.encode()
         params['access_token'] = self.auth
-        response = binapi.send_request(method, params, data)
-        if close_sock: binapi.close_socket()
+        retries = 1 if method in IDEMPOTENT else 0
+        while True:
+            try:
+                response = self._binary_request(method, params, data,
+                                                progress)
+                if response['result'] != 9000 or not retries:
+                    break
+            except OSError:
+                if not retries: raise
+            # the connection dropped; retry on a new one, which fails
+            # over to the next server if this one cannot be reached
+            retries -= 1
+            with metrics.lock:
+                metrics.retries += 1
         # stat is allowed to fail (clients needs to know); all other
         # errors are fatal
         if response['result'] == 0 or method == 'stat':
             return response
         if DEBUG:
+            import traceback
             traceback.print_stack()
         raise PCloudException(self.config[Key.ENDPOINT],
                               response['result'], response['error'])
         return
 
+    def _binary_request(self, method, params, data, progress):
+        '''Send binary request on a session. Returns response.'''
+        with self.session() as session:
+            start = time.perf_counter()
+            sent, received = session.bytes_sent, session.bytes_received
+            with profiler.span(method):
+                response = session.send_request(method, params, data,
+                                                progress)
+            metrics.record(method, time.perf_counter() - start,
+                           session.bytes_sent - sent,
+                           session.bytes_received - received,
+                           response['result'], binary=True)
+            if response['result'] in (9000, 9002): session.close()
+        return response
+
+    def binary_requests(self, requests, window=binapi.PIPELINE_WINDOW):
+        '''Send binary requests, pipelined over a single connection.
+
+        requests is a list of (method, params, data) tuples. Returns
+        list of responses in request order. Failed calls are returned,
+        not raised; the caller must check each result.
+        '''
+        requests = [(method, dict(params, access_token=self.auth),
+                     data.encode() if isinstance(data, str) else data)
+                    for method, params, data in requests]
+        with self.session() as session:
+            start = time.perf_counter()
+            sent, received = session.bytes_sent, session.bytes_received
+            with profiler.span('batch', calls=len(requests)):
+                responses = session.send_requests(requests, window)
+            # pipelined calls overlap, so share time and bytes equally
+            n = len(requests) or 1
+            seconds = (time.perf_counter() - start) / n
+            sent = (session.bytes_sent - sent) // n
+            received = (session.bytes_received - received) // n
+            if responses and responses[-1]['result'] in (9000, 9002):
+                session.close()
+        for (method, _, _), response in zip(requests, responses):
+            metrics.record(method, seconds, sent, received,
+                           response['result'], binary=True)
+        return responses
+
+    def batch(self, window=binapi.PIPELINE_WINDOW):
+        '''Return Batch for collecting binary API calls.'''
+        return Batch(self, window)
+
     def _auth(self):
         '''Handles OAUTH login to pCloud. '''
 
@@ -226,6 +458,7 @@ class PCloud:
                 f'client_id={self.config[Key.CLIENT_ID]}&' \
                 'force_reapprove=0&' \
                 'response_type=code'
+            import webbrowser
             webbrowser.open(url)
             code = input('Enter code displayed on pCloud web page: ').\
                 strip()
@@ -273,13 +506,24 @@ class PCloud:
         '''
         save_required = False
         try:
-            opts,args = getopt.getopt(sys.argv[1:],'e:f:rst:u:v', aspect_opts)
+            opts,args = getopt.getopt(sys.argv[1:],'e:f:rst:u:v',
+                                      list(aspect_opts) +
+                                      [Key.STATS, Key.STATS_FILE+'=',
+                                       Key.PROFILE+'='])
             for o,v in opts:
-                if o == '-e':
+                if o == '--'+Key.STATS:
+                    atexit.register(
+                        lambda: print(metrics.summary(), file=sys.stderr))
+                elif o == '--'+Key.STATS_FILE:
+                    atexit.register(metrics.dump, v)
+                elif o == '--'+Key.PROFILE:
+                    profiler.start(v)
+                elif o == '-e':
                     self.config[Key.ENDPOINT] = v
                 elif o =='-f':
                     self.config = read_config(self.config, v, optional=False)
                     self.config[Key.CONFIG_FILE] = v
+                    self.auth = self.config[Key.TOKEN]
                 elif o == '-r':
                     self.config[Key.REAUTH] = True
                 elif o == '-s':
@@ -303,15 +547,231 @@ class PCloud:
 
         return args
 
+class Batch:
+    '''Collect binary API calls for pipelined execution.
+
+    Normally used as a context manager; the collected calls are
+    executed in order when the context exits:
+
+        with pcloud.batch() as batch:
+            for path in paths:
+                batch.stat(path=path)
+        for response in batch.results:
+            ...
+
+    Each call method returns the index of its response in
+    results. Failed calls do not raise; they are reported by
+    failures().
+    '''
+    def __init__(self, pcloud, window=binapi.PIPELINE_WINDOW):
+        self.pcloud = pcloud
+        self.window = window
+        self.requests = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.execute()
+        return False
+
+    def add(self, method, params, data=b''):
+        '''Add call of method with params (and data) to batch.'''
+        self.requests.append((method, params, data))
+        return len(self.requests) - 1
+
+    def stat(self, **params):
+        return self.add('stat', params)
+
+    def deletefile(self, **params):
+        return self.add('deletefile', params)
+
+    def deletefolder(self, **params):
+        return self.add('deletefolder', params)
+
+    def createfolderifnotexists(self, **params):
+        return self.add('createfolderifnotexists', params)
+
+    def copyfile(self, **params):
+        return self.add('copyfile', params)
+
+    def execute(self):
+        '''Execute calls not yet executed. Returns list of all results.'''
+        if len(self.results) < len(self.requests):
+            self.results += self.pcloud.binary_requests(
+                self.requests[len(self.results):], self.window)
+        return self.results
+
+    def failures(self):
+        '''Return list of (index, method, params, response) for failed
+        calls.'''
+        return [(i, method, params, response)
+                for i, ((method, params, _), response)
+                in enumerate(zip(self.requests, self.results))
+                if response['result'] != 0]
+
+class Metrics():
+    '''Statistics on pCloud API calls, kept per method.
+
+    For each method, the number of calls, latency histogram, bytes
+    sent and received and error codes are recorded. Counts of binary
+    API connections opened and requests sent give the connection reuse
+    rate; the connections whose TLS sessions were resumed are counted
+    too. A single instance, metrics, records all calls made by
+    PCloud instances and get_url.
+    '''
+    # histogram bucket upper bounds, in seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+               10.0, float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.connections = 0
+        self.resumed = 0
+        self.binary_requests = 0
+        self.retries = 0
+        return
+
+    def record(self, method, seconds, sent, received, result,
+               binary=False):
+        '''Record a call of method, taking seconds, with result code.'''
+        with self.lock:
+            m = self.methods.get(method)
+            if m is None:
+                m = self.methods[method] = {
+                    'calls': 0, 'seconds': 0.0, 'max': 0.0,
+                    'buckets': [0] * len(self.BUCKETS), 'sent': 0,
+                    'received': 0, 'errors': {}}
+            m['calls'] += 1
+            m['seconds'] += seconds
+            m['max'] = max(m['max'], seconds)
+            m['buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            m['sent'] += sent
+            m['received'] += received
+            if result:
+                m['errors'][str(result)] = m['errors'].get(str(result), 0) + 1
+            if binary:
+                self.binary_requests += 1
+        return
+
+    def reuse(self):
+        '''Return fraction of binary requests made on a reused
+           connection.'''
+        if not self.binary_requests:
+            return 0.0
+        return max(0.0, 1 - self.connections / self.binary_requests)
+
+    def quantile(self, method, q):
+        '''Return histogram bucket bound for quantile q of method
+           latency.'''
+        m = self.methods[method]
+        target = q * m['calls']
+        total = 0
+        for bound, count in zip(self.BUCKETS, m['buckets']):
+            total += count
+            if total >= target:
+                return min(bound, m['max'])
+        return m['max']
+
+    def as_dict(self):
+        with self.lock:
+            return {'methods': copy.deepcopy(self.methods),
+                    'buckets': list(self.BUCKETS[:-1]),
+                    'connections': self.connections,
+                    'tls_resumed': self.resumed,
+                    'binary_requests': self.binary_requests,
+                    'connection_reuse': self.reuse(),
+                    'retries': self.retries}
+
+    def summary(self):
+        '''Return human readable summary as a string.'''
+        lines = [f'{"method":24} {"calls":>6} {"errors":>6} {"mean ms":>8} '
+                 f'{"p95 ms":>8} {"max ms":>8} {"sent":>10} {"received":>10}']
+        for method in sorted(self.methods):
+            m = self.methods[method]
+            lines.append(f'{method:24} {m["calls"]:6} '
+                         f'{sum(m["errors"].values()):6} '
+                         f'{1000 * m["seconds"] / m["calls"]:8.1f} '
+                         f'{1000 * self.quantile(method, 0.95):8.1f} '
+                         f'{1000 * m["max"]:8.1f} '
+                         f'{m["sent"]:10} {m["received"]:10}')
+        errors = {}
+        for m in self.methods.values():
+            for code, n in m['errors'].items():
+                errors[code] = errors.get(code, 0) + n
+        lines.append(f'binary connections: {self.connections} opened '
+                     f'({self.resumed} TLS resumed) for '
+                     f'{self.binary_requests} requests '
+                     f'({100 * self.reuse():.1f}% reuse); '
+                     f'retries: {self.retries}')
+        if errors:
+            lines.append('error codes: ' +
+                         ', '.join(f'{code}: {n}' for code, n in
+                                   sorted(errors.items())))
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        '''Return metrics in Prometheus text exposition format.'''
+        lines = ['# TYPE pcloud_request_seconds histogram']
+        for method, m in sorted(self.methods.items()):
+            total = 0
+            for bound, count in zip(self.BUCKETS, m['buckets']):
+                total += count
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'pcloud_request_seconds_bucket'
+                             f'{{method="{method}",le="{le}"}} {total}')
+            lines.append(f'pcloud_request_seconds_sum{{method="{method}"}} '
+                         f'{m["seconds"]}')
+            lines.append(f'pcloud_request_seconds_count{{method="{method}"}} '
+                         f'{m["calls"]}')
+        for name, key in (('sent', 'sent'), ('received', 'received')):
+            lines.append(f'# TYPE pcloud_bytes_{name}_total counter')
+            for method, m in sorted(self.methods.items()):
+                lines.append(f'pcloud_bytes_{name}_total'
+                             f'{{method="{method}"}} {m[key]}')
+        lines.append('# TYPE pcloud_errors_total counter')
+        for method, m in sorted(self.methods.items()):
+            for code, n in sorted(m['errors'].items()):
+                lines.append(f'pcloud_errors_total{{method="{method}",'
+                             f'code="{code}"}} {n}')
+        for name, value in (('connections_total', self.connections),
+                            ('tls_resumed_total', self.resumed),
+                            ('binary_requests_total', self.binary_requests),
+                            ('retries_total', self.retries)):
+            lines.append(f'# TYPE pcloud_{name} counter')
+            lines.append(f'pcloud_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename):
+        '''Write metrics to filename; Prometheus text format if filename
+           ends with .prom, otherwise JSON.'''
+        filename = os.path.expanduser(os.path.expandvars(filename))
+        if filename.endswith('.prom'):
+            with open(filename, 'w') as f:
+                f.write(self.prometheus())
+        else:
+            save_json(self.as_dict(), filename, indent='  ')
+        return
+
+metrics = Metrics()
+
 def _save_options(config, aspect_key, aspect_opts):
     '''Remove transient aspect options prior to saving configuration
-       to file.
+       to file. The file is not rewritten if its contents would not
+       change.
     '''
     save_config = copy.deepcopy(config)
     for opt in aspect_opts:
         if (not "=" in opt) and opt in save_config[aspect_key]:
             del save_config[aspect_key][opt]
-    save_json(save_config, save_config[Key.CONFIG_FILE], indent = "  ")
+    config_file = save_config[Key.CONFIG_FILE]
+    if os.path.exists(os.path.expanduser(os.path.expandvars(config_file))) \
+       and load_json(config_file) == save_config:
+        return
+    save_json(save_config, config_file, indent = "  ")
     return
 
 def _expired(expires):
@@ -342,13 +802,149 @@ def chunked(array, chunk_size):
     else:
         return (array[:chunk_size], array[chunk_size:])
 
-def get_url(url):
-    'Return contents of url.'
+def max_fileids(ids, limit=MAX_POST):
+    '''Return the number of the fileids in ids which can be sent in one
+       collection call, whose POST body is at most limit bytes.'''
+    width = max((len(str(id)) for id in ids), default=1) + 1
+    return max(1, (limit - POST_RESERVE) // width)
+
+def get_url(url, context=None, progress=None):
+    '''Return contents of url.
+
+    If progress is provided, the contents are read in chunks, and
+    progress called with the number of bytes in each chunk.
+    '''
+    import urllib.request
+    start = time.perf_counter()
     req = urllib.request.Request(url)
-    resp = urllib.request.urlopen(req)
-    resp_text = resp.read()#.decode('utf-8')
+    with profiler.span('download', url=url):
+        resp = _opener(context or ssl_context()).open(req)
+        if progress:
+            buf = bytearray()
+            while chunk := resp.read(binapi.SEND_CHUNK):
+                buf += chunk
+                progress(len(chunk))
+            resp_text = bytes(buf)
+        else:
+            resp_text = resp.read()#.decode('utf-8')
+    metrics.record('download', time.perf_counter() - start, len(url),
+                   len(resp_text), 0)
     return resp_text
 
+def open_url(url, context=None):
+    '''Return response to a GET of url, from which its contents may be
+       read as they arrive.'''
+    import urllib.request
+    return _opener(context or ssl_context()).open(urllib.request.Request(url))
+
+def copy_url(url, out, context=None, progress=None):
+    '''Copy contents of url to binary file object out, in chunks, as
+       they arrive. progress, if provided, is called with the number of
+       bytes in each chunk. Returns number of bytes copied.'''
+    start = time.perf_counter()
+    nbytes = 0
+    with profiler.span('download', url=url):
+        resp = open_url(url, context)
+        while chunk := resp.read(binapi.SEND_CHUNK):
+            out.write(chunk)
+            nbytes += len(chunk)
+            if progress: progress(len(chunk))
+    metrics.record('download', time.perf_counter() - start, len(url),
+                   nbytes, 0)
+    return nbytes
+
+def _endpoint_cache_file(config):
+    config_file = os.path.expanduser(
+        os.path.expandvars(config[Key.CONFIG_FILE]))
+    return os.path.join(os.path.dirname(config_file), ENDPOINT_CACHE)
+
+def _load_endpoint_cache(config):
+    '''Return contents of endpoint cache for config, or empty dict.'''
+    try:
+        with open(_endpoint_cache_file(config)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _split_host(server, port):
+    '''Return (hostname, port) of server, as host[:port].'''
+    hostname, _, server_port = server.partition(':')
+    return (hostname, int(server_port) if server_port.isdigit() else port)
+
+def probe(hosts, timeout):
+    '''Return list of the (hostname, port) addresses in hosts to which a
+       TCP connection can be made within timeout seconds, fastest
+       first. The connections are made at once, from separate threads.'''
+    times = {}
+
+    def connect(address):
+        start = time.perf_counter()
+        try:
+            socket.create_connection(address, timeout).close()
+            times[address] = time.perf_counter() - start
+        except OSError:
+            pass
+        return
+
+    threads = [threading.Thread(target=connect, args=(address,))
+               for address in hosts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(times, key=times.get)
+
+# SSL contexts, by CA file; see ssl_context
+_ssl_contexts = {}
+_ssl_lock = threading.Lock()
+
+def ssl_context(cafile=None):
+    '''Return SSL context verifying certificates against cafile, or the
+       system defaults if None, shared by all callers in the process.'''
+    with _ssl_lock:
+        if cafile not in _ssl_contexts:
+            _ssl_contexts[cafile] = ssl.create_default_context(cafile=cafile)
+        return _ssl_contexts[cafile]
+
+# urllib openers, by SSL context; see _opener
+_openers = {}
+
+def _opener(context):
+    '''Return urllib opener whose HTTPS connections use context, and
+       resume TLS sessions saved in binapi.tls_sessions.'''
+    if context in _openers:
+        return _openers[context]
+    import urllib.request
+    import http.client
+
+    class HTTPSConnection(http.client.HTTPSConnection):
+        def connect(self):
+            self.address = (self._tunnel_host, self._tunnel_port) \
+                if self._tunnel_host else (self.host, self.port)
+            with profiler.span('connect', host=f'{self.address[0]}:'
+                               f'{self.address[1]}') as span:
+                http.client.HTTPConnection.connect(self)
+                self.sock = self._context.wrap_socket(
+                    self.sock, server_hostname=self.address[0],
+                    session=binapi.tls_sessions.get(self._context,
+                                                    self.address))
+                span.set(resumed=self.sock.session_reused)
+            return
+
+        def getresponse(self):
+            response = super().getresponse()
+            # the headers are read, so any TLS 1.3 ticket has arrived
+            if self.sock:
+                binapi.tls_sessions.save(self.sock, self.address)
+            return response
+
+    class HTTPSHandler(urllib.request.HTTPSHandler):
+        def https_open(self, req):
+            return self.do_open(HTTPSConnection, req, context=context)
+
+    _openers[context] = urllib.request.build_opener(HTTPSHandler())
+    return _openers[context]
+
 def save_json(data, filename, indent=None):
     '''Write data to filename in JSON format.
 
@@ -360,7 +956,7 @@ def save_json(data, filename, indent=None):
     if dirname and not os.path.exists(dirname):
         os.makedirs(dirname)
     if not os.path.exists(filename): _create_private(filename)
-    with open(filename,'w') as f:
+    with profiler.span('json save', file=filename), open(filename,'w') as f:
         json.dump(data, f, indent=indent)
         f.write('\n')
     return
@@ -368,7 +964,7 @@ def save_json(data, filename, indent=None):
 def load_json(filename):
     filename = os.path.expanduser(os.path.expandvars(filename))
     try:
-        with open(filename) as f:
+        with profiler.span('json load', file=filename), open(filename) as f:
             contents = json.load(f)
     except json.decoder.JSONDecodeError as err:
         error(f'unable to read: {filename}: {err}')
@@ -382,7 +978,7 @@ def read_config(config, config_file, optional=True):
     merged config dict is returned.
 
     '''
-    n_config = copy.deepcopy(config)
+    n_config = dict(config)
     config_file = os.path.expanduser(os.path.expandvars(config_file))
     if os.path.exists(config_file):
         r_config = load_json(config_file)
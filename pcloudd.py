@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+'''
+NAME
+ pcloudd.py - pCloud daemon, running pcloud utility commands
+
+SYNOPSIS
+ python pcloudd.py [common_options] [start | stop | status]
+
+DESCRIPTION
+ Each run of pcutil.py, playlist.py or token.py reads its
+ configuration, authenticates and opens a TLS connection to pCloud;
+ for short commands, that is most of the work. pcloudd.py holds
+ binary API connections open and the pcutil.py folder cache warm, and
+ listens on a Unix domain socket. When it is running, the utilities
+ forward their command lines to it, and it runs them in-process,
+ sending their output back. Commands cost one local round trip plus
+ the API calls themselves. The daemon itself is in daemon.py, loaded
+ only by start, so that the utilities do not load it.
+
+ start (the default) runs the daemon in the foreground; stop and
+ status control a running daemon. The common options given to the
+ daemon choose the endpoint to which a connection is opened at
+ start; connections opened by commands, to any endpoint, are kept
+ open for later commands too.
+
+ The socket is ~/.cache/pcloud/pcloudd.sock, or the pathname in the
+ PCLOUDD_SOCKET environment variable. Set PCLOUDD=off to run a
+ command without the daemon. Commands with the --stats, --stats-file
+ or --profile options, or -r (reauthenticate), are always run without
+ the daemon, as they concern the process itself, as are commands
+ reading standard input or writing file contents to standard output.
+
+ The daemon assumes it makes all changes to the pCloud folders it
+ caches. Should a folder be deleted elsewhere, commands using the
+ cached folder fail once, after which the cache is cleared.
+'''
+
+import os
+import sys
+import json
+import socket
+import pcloudapi
+
+class Key():
+    ASPECT = 'pcloudd'
+
+SOCKET = '~/.cache/pcloud/pcloudd.sock'
+
+# Programs which may be run by the daemon
+PROGRAMS = ('pcutil.py', 'playlist.py', 'token.py')
+
+# Options handled by the process itself, which are not forwarded
+LOCAL_OPTIONS = ('--stats', '--profile')
+
+def socket_path():
+    return os.path.expanduser(os.environ.get('PCLOUDD_SOCKET', SOCKET))
+
+def local_only(argv):
+    '''Return True if command line argv must be run without the daemon.'''
+    for arg in argv:
+        if arg.startswith(LOCAL_OPTIONS):
+            return True
+        # the daemon cannot read the client's standard input, nor
+        # write binary data to its standard output (cp - or --from-file -)
+        if arg in ('-', '--from-file=-'):
+            return True
+    # -r (reauthenticate) among the common options, which precede the
+    # first argument
+    for arg in argv:
+        if not arg.startswith('-') or arg.startswith('--'):
+            break
+        for flag in arg[1:]:
+            if flag == 'r':
+                return True
+            if flag in 'eftu':
+                break
+    return False
+
+def connect():
+    '''Return socket connected to daemon, or None if it is not running.'''
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path())
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+def call(conn, message):
+    '''Send message to daemon on conn, copying command output to
+       stdout and stderr. Return command exit status.'''
+    with conn, conn.makefile('rwb') as f:
+        f.write(json.dumps(message).encode() + b'\n')
+        f.flush()
+        for line in f:
+            frame = json.loads(line)
+            if 'exit' in frame:
+                return frame['exit']
+            out = sys.stdout if frame['fd'] == 1 else sys.stderr
+            out.write(frame['data'])
+            out.flush()
+    pcloudapi.error('lost connection to pcloudd')
+    return
+
+def forward():
+    '''Run this command in the daemon, if it is running, and exit with
+       its status. Returns if the command is to be run locally.'''
+    program = os.path.basename(sys.argv[0])
+    if os.environ.get('PCLOUDD') == 'off' or program not in PROGRAMS or \
+       local_only(sys.argv[1:]):
+        return
+    if (conn := connect()) is None:
+        return
+    import shutil
+    sys.exit(call(conn, {'program': program, 'argv': sys.argv[1:],
+                         'cwd': os.getcwd(), 'tty': sys.stderr.isatty(),
+                         'columns': shutil.get_terminal_size().columns}))
+    return
+
+def main():
+    pcloud = pcloudapi.PCloud()
+    pcloud.config[Key.ASPECT] = {}
+    args = pcloud.merge_command_options(Key.ASPECT, ())
+    command = args[0] if args else 'start'
+    if len(args) > 1 or command not in ('start', 'stop', 'status'):
+        pcloudapi.error('usage: pcloudd.py [common_options] '
+                        '[start | stop | status]')
+    try:
+        if command == 'start':
+            import daemon
+            daemon.start(pcloud)
+        elif (conn := connect()) is None:
+            pcloudapi.error(f'not running on {socket_path()}')
+        else:
+            sys.exit(call(conn, {'control': command}))
+    except pcloudapi.PCloudException as err:
+        pcloudapi.error(f'error: {err.code}; message: {err.msg}')
+    return
+
+if __name__ == '__main__':
+    main()
@@ -4,25 +4,76 @@
 #
 # Usage:
 #  python pcutil.py [common_options]
-#                   {cp [-dr] source destination | rm [-dr] file [file ...]}
+#                   {cp [-dDPru] [-w workers] [--bwlimit limit]
+#                       [--cache] [--cache-size MiB] [--link] [--zip]
+#                       source [source ...] destination |
+#                    cp [-dDPru] [-j jobs] [--bwlimit limit] [--cache ...]
+#                       --from-file file |
+#                    mv [-d] source destination |
+#                    rm [-dr] [-j jobs] file [file ...]}
 #
-#  For the cp command, the pCLoud location in source or destination
+#  For the cp and mv commands, the pCLoud location in source or destination
 #  is indicated by a p:/ prefix. The prefix is not required for the rm
 #  command; it is assumed.  All pCloud locations are absolute.
 #
+#  cp --from-file reads source and destination pairs, one pair per line,
+#  from file ('-' for standard input).
+#
+#  A cp source of '-' is standard input, streamed to the pCloud file
+#  named as destination; a destination of '-' is standard output, to
+#  which the pCloud source file is streamed.
+#
+#  cp -r plans the whole copy before transferring any file, then
+#  transfers the files largest first, with workers (-w) files in
+#  transfer at once. --bwlimit caps the combined rate of all
+#  transfers, optionally by time of day (see throttle.py).
+#
+#  cp -r --zip downloads a pCloud folder as one zip archive
+#  (getziplink), extracting it while it arrives (see zipstream.py).
+#
+#  cp --cache keeps copies of files downloaded from pCloud in a local
+#  cache, and copies them from it while they are unchanged on pCloud
+#  (see filecache.py).
+#
+#  cp -D copies files whose contents are already on pCloud, or have
+#  been uploaded by the same run, with copyfile, rather than uploading
+#  them again.
+#
 
 import pcloudapi
 import binapi
 import os
 import sys
 import getopt
+import fnmatch
+import shlex
+import itertools
+import hashlib
+import time
+import progress
+import profiler
+import threading
+import pcloudd
+import scancache
+import throttle
 
 DEBUG = False
 
 class Key():
     ASPECT = 'pcutil'
+    BWLIMIT = 'bwlimit'
+    CACHE = 'cache'
+    CACHE_SIZE = 'cache-size'
+    DEDUP = 'dedup'
     DRYRUN = 'dryrun'
+    FROM_FILE = 'from-file'
+    JOBS = 'jobs'
+    LINK = 'link'
+    PROGRESS = 'progress'
     RECURSIVE = 'recursive'
+    UPDATE = 'update'
+    WORKERS = 'workers'
+    ZIP = 'zip'
 
 def normpath(path):
     return os.path.normpath(path).replace('//', '/')
@@ -51,17 +102,226 @@ def get_folder_structure(pcloud, path, fileid, fs = {}):
     return fs
 
 def pwalk(pcloud, folderid, folder_name):
-    '''Walks pCloud filesystem ala os.walk. For each file/folder,
-       returns a tuple of (id, name).'''
+    '''Walks pCloud filesystem ala os.walk. For each folder, returns
+       a tuple of (id, name); for each file, (id, name, size).'''
     entries = get_contents(pcloud, folderid)
     folders = [(entry['folderid'], folder_name+'/'+entry['name'])
                for entry in entries if entry['isfolder']]
-    files = [(entry['fileid'], folder_name+'/'+entry['name'])
+    files = [(entry['fileid'], folder_name+'/'+entry['name'],
+              entry.get('size', 0))
              for entry in entries if not entry['isfolder']]
+    file_hashes.update((entry['fileid'], entry['hash'])
+                       for entry in entries if 'hash' in entry)
     yield [(folderid, folder_name), folders, files]
     for folder in folders:
         yield from pwalk(pcloud, folder[0], folder[1])
 
+class FolderCache():
+    '''Map of pCloud folder pathnames to folderid.
+
+    A single instance, folder_cache, is shared by all operations in a
+    pcutil invocation (and, under pcloudd.py, by successive
+    invocations for the same account; see check_account and
+    end_command). It is seeded from a listing of the destination
+    folder and updated as folders are created, so that folders known
+    to exist cost no further API calls.
+    '''
+    def __init__(self):
+        self.folders = {'/': 0}
+
+    def get(self, path):
+        '''Return folderid of path, or None if not cached.'''
+        return self.folders.get(normpath('/' + path))
+
+    def add(self, path, folderid):
+        self.folders[normpath('/' + path)] = folderid
+        return
+
+    def discard(self, path):
+        '''Remove path, and any folders below it, from the cache.'''
+        path = normpath('/' + path)
+        prefix = path.rstrip('/') + '/'
+        for folder in [f for f in self.folders
+                       if f == path or f.startswith(prefix)]:
+            if folder != '/': del self.folders[folder]
+        return
+
+    def seed(self, pcloud, path, folderid, index=None):
+        '''Add folders found by a single listing of path (whose id is
+           folderid) to the cache. If index, a ContentIndex, is given,
+           the files listed are added to it.'''
+        resp = pcloud.binary_request('listfolder',
+                                     {'folderid': folderid, 'recursive': 1,
+                                      'nofiles': 0 if index else 1})
+        if index: index.add_listing(resp['metadata'])
+        stack = [(normpath('/' + path), resp['metadata'])]
+        while stack:
+            path, meta = stack.pop()
+            self.add(path, meta['folderid'])
+            stack += [(f'{path.rstrip("/")}/{entry["name"]}', entry)
+                      for entry in meta.get('contents', [])
+                      if entry['isfolder']]
+        return
+
+folder_cache = FolderCache()
+
+# Endpoint and access token of the account whose folders are in
+# folder_cache; see check_account
+folder_cache_account = None
+
+class ContentIndex():
+    '''Files on pCloud, found by their contents, for cp -D.
+
+    Files uploaded by this run are indexed by SHA-1. Files already on
+    pCloud are indexed by size, from listings of destination folders;
+    only when a local file of the same size is to be uploaded are
+    their SHA-1 hashes asked for, by a batch of checksumfile calls,
+    one for each distinct pCloud hash of that size.
+
+    Each file is held as a (fileid, hash) tuple. The pCloud hash of
+    the file at each (folderid, name) indexed is kept too, so that
+    files already in place are not copied again.
+
+    Identical files are the same size, so cp -r workers, taking files
+    largest first, start them together. The SHA-1 of each file being
+    uploaded is held as pending, and a worker finding it waits for
+    that upload, then copies the file uploaded.
+    '''
+    def __init__(self, jobs=binapi.PIPELINE_WINDOW):
+        self.jobs = jobs
+        self.sha1s = {}
+        self.sizes = {}
+        self.names = {}
+        self.listed = set()
+        self.pending = {}
+        self.files = 0
+        self.bytes = 0
+        self.lock = threading.Lock() # held by find and add, for cp -r workers
+        return
+
+    def add_listing(self, meta):
+        '''Add files in listfolder metadata meta, and its sub-folders,
+           to the index.'''
+        stack = [meta]
+        while stack:
+            meta = stack.pop()
+            self.listed.add(meta['folderid'])
+            for entry in meta.get('contents', []):
+                if entry['isfolder']:
+                    stack.append(entry)
+                else:
+                    self.sizes.setdefault(entry['size'], {}).setdefault(
+                        entry['hash'], (entry['fileid'], entry['hash']))
+                    self.names[(entry['parentfolderid'], entry['name'])] = \
+                        entry['hash']
+        return
+
+    def index(self, pcloud, folderid):
+        '''Add the files in pCloud folder folderid, and its
+           sub-folders, to the index, unless already listed.'''
+        if folderid >= 0 and folderid not in self.listed:
+            resp = pcloud.binary_request('listfolder',
+                                         {'folderid': folderid,
+                                          'recursive': 1})
+            self.add_listing(resp['metadata'])
+        return
+
+    def add(self, sha1, meta):
+        '''Add file with hex SHA-1 sha1, and metadata meta, uploaded by
+           this run.'''
+        with self.lock:
+            self.sha1s.setdefault(sha1, (meta['fileid'], meta['hash']))
+            self.names[(meta['parentfolderid'], meta['name'])] = meta['hash']
+        return
+
+    def find(self, pcloud, size, sha1):
+        '''Return file on pCloud of size bytes with hex SHA-1 sha1, or
+           None. If None, the caller is to upload the file, and must
+           call uploaded(sha1) once it has finished, or failed.'''
+        while True:
+            with self.lock:
+                if (candidates := self.sizes.pop(size, None)):
+                    candidates = list(candidates.values())
+                    with pcloud.batch(self.jobs) as batch:
+                        for fileid, _ in candidates:
+                            batch.add('checksumfile', {'fileid': fileid})
+                    for file, resp in zip(candidates, batch.results):
+                        if resp['result'] == 0:
+                            self.sha1s.setdefault(resp['sha1'], file)
+                if (file := self.sha1s.get(sha1)) is not None:
+                    return file
+                if (upload := self.pending.get(sha1)) is None:
+                    self.pending[sha1] = threading.Event()
+                    return None
+            # another worker is uploading the same contents
+            upload.wait()
+
+    def uploaded(self, sha1):
+        '''Record upload of file with hex SHA-1 sha1 as finished.'''
+        with self.lock:
+            if (upload := self.pending.pop(sha1, None)) is not None:
+                upload.set()
+        return
+
+    def holds(self, folderid, name, file):
+        '''Return True if file is known to be in folder folderid as
+           name, or a file with the same contents is.'''
+        return self.names.get((folderid, name)) == file[1]
+
+    def saved(self, nbytes):
+        '''Record nbytes not uploaded.'''
+        with self.lock:
+            self.files += 1
+            self.bytes += nbytes
+        return
+
+    def summary(self):
+        return f'cp: {self.files} duplicate file(s) not uploaded; ' \
+            f'{progress.format_bytes(self.bytes)} saved.'
+
+# Files on pCloud by contents, for -D; None otherwise
+content_index = None
+
+# Progress of file transfers; replaced by progress.Progress for -P
+transfers = progress.NullProgress()
+
+# Limiter of transfer bandwidth, for --bwlimit; None otherwise
+bandwidth = None
+
+# Local cache of downloaded files, for --cache; None otherwise
+file_cache = None
+
+# Number of local files and directories skipped by cp -r, as they
+# could not be read; see copy_to_remote
+unreadable = 0
+
+# pCloud content hash of files, by fileid, found by the stat and
+# listfolder calls made by copy_files; see file_hash.
+file_hashes = {}
+
+# Size of files, by fileid, found by the same stat calls; used to
+# report progress of single file downloads
+file_sizes = {}
+
+# Default number of files transferred at once by cp -r
+WORKERS = 4
+
+# Results of stat calls sent ahead, as a batch, for a chunk of the
+# pairs copied by copy_files; see prefetch_pathinfo.
+pathinfo_cache = {}
+
+# Number of source and destination pairs read and looked up at a time
+PREFETCH_CHUNK = 1000
+
+# Local files of at least this size are mapped into memory, not read
+MMAP_THRESHOLD = 1024 * 1024
+
+# Size of chunks of standard input sent by upload_stream
+UPLOAD_CHUNK = 4 * 1024 * 1024
+
+# Source or destination name standing for standard input or output
+STDIO = '-'
+
 def create_folder(pcloud, folderid, name):
     '''Create folder on pCloud, located in folderid, named name.'''
     resp = pcloud.binary_request('createfolderifnotexists',
@@ -71,28 +331,142 @@ def create_folder(pcloud, folderid, name):
 
 def create_folders(pcloud, path):
     '''Create pcloud folders named in absolute path, if they don't
-       already exist. Returns id of deepest folder.'''
-    folders = path.strip('/').split('/')
-    folderid = 0
-    for folder in folders:
-        if folder:
-            folderid = create_folder(pcloud, folderid, folder)
+       already exist. Returns id of deepest folder. Only folders
+       missing from the folder cache are requested from pCloud.'''
+    folders = [folder for folder in path.split('/') if folder]
+    n = len(folders)
+    while (folderid := folder_cache.get('/'.join(folders[:n]))) is None:
+        n -= 1
+    for i in range(n, len(folders)):
+        folderid = create_folder(pcloud, folderid, folders[i])
+        folder_cache.add('/'.join(folders[:i+1]), folderid)
     return folderid
 
 def get_pathinfo(pcloud, path):
     '''Return tuple of isfolder and id (for either file or folder.'''
-    if path == '/': return (True, 0)
+    if (folderid := folder_cache.get(path)) is not None:
+        return (True, folderid)
+    if (info := pathinfo_cache.get(normpath('/' + path))) is not None:
+        return info
     resp = pcloud.binary_request('stat', {'path': path})
     if resp['result'] == 0:
         isfolder = resp['metadata']['isfolder']
+        if isfolder:
+            folder_cache.add(path, resp['metadata']['folderid'])
+        else:
+            file_hashes[resp['metadata']['fileid']] = resp['metadata']['hash']
+            file_sizes[resp['metadata']['fileid']] = resp['metadata']['size']
         return (isfolder, resp['metadata']['folderid'] if isfolder \
                 else resp['metadata']['fileid'])
     return (False, -1)
 
-def upload_file(pcloud, folderid, filename, data):
+def upload_file(pcloud, folderid, filename, data, name='', sha1=None):
+    '''Upload data to pCloud folder folderid as filename. name
+       identifies the file in progress reports.
+
+    data is hashed as it is sent, each chunk straight after it is
+    written to the socket, unless sha1, its hex SHA-1, is given. The
+    hash is checked against the checksum pCloud reports for the
+    uploaded file. Returns hex SHA-1 of data.
+    '''
     params = {'filename': filename, 'folderid': folderid}
-    resp = pcloud.binary_request('uploadfile', params, data)
-    return
+    stream = transfers.stream(name or filename, len(data))
+    hasher = None if sha1 else hashlib.sha1()
+    sent = 0
+
+    def update(nbytes):
+        nonlocal sent
+        if hasher: hasher.update(data[sent:sent+nbytes])
+        sent += nbytes
+        if stream.update: stream.update(nbytes)
+        if bandwidth: bandwidth.wait(nbytes)
+        return
+
+    resp = pcloud.binary_request('uploadfile', params, data, update)
+    stream.done()
+    sha1 = sha1 or hasher.hexdigest()
+    checksums = resp.get('checksums') or [{}]
+    if checksums[0].get('sha1', sha1) != sha1:
+        pcloudapi.error(f'checksum mismatch on upload: {name or filename}')
+    if content_index is not None and resp.get('metadata'):
+        content_index.add(sha1, resp['metadata'][0])
+    return sha1
+
+def upload_stream(pcloud, folderid, filename, f, name=''):
+    '''Upload contents of binary file object f, of unknown length, to
+       pCloud folder folderid as filename. name identifies the file in
+       progress reports.
+
+    f is read and sent UPLOAD_CHUNK bytes at a time, through an upload
+    session (upload_create, upload_write and upload_save), so memory
+    use is constant. The SHA-1 of the contents is checked against
+    pCloud's checksum of the file saved. Returns hex SHA-1.
+    '''
+    resp = pcloud.binary_request('upload_create', {})
+    uploadid = resp['uploadid']
+    stream = transfers.stream(name or filename)
+    transfers.add(0)
+    sha1 = hashlib.sha1()
+    offset = 0
+
+    def update(nbytes):
+        if stream.update: stream.update(nbytes)
+        if bandwidth: bandwidth.wait(nbytes)
+        return
+
+    while True:
+        with profiler.span('read', file=name or filename):
+            chunk = f.read(UPLOAD_CHUNK)
+        if not chunk:
+            break
+        transfers.add(len(chunk), 0)
+        pcloud.binary_request('upload_write', {'uploadid': uploadid,
+                                               'uploadoffset': offset},
+                              chunk, update)
+        sha1.update(chunk)
+        offset += len(chunk)
+    resp = pcloud.binary_request('upload_save', {'uploadid': uploadid,
+                                                 'folderid': folderid,
+                                                 'name': filename})
+    stream.done()
+    meta = resp['metadata']
+    sha1 = sha1.hexdigest()
+    resp = pcloud.binary_request('checksumfile', {'fileid': meta['fileid']})
+    if resp.get('sha1', sha1) != sha1:
+        pcloudapi.error(f'checksum mismatch on upload: {name or filename}')
+    if content_index is not None:
+        content_index.add(sha1, meta)
+    return sha1
+
+def put_file(pcloud, folderid, filename, data, name=''):
+    '''Put data in pCloud folder folderid as filename, as upload_file.
+
+    For cp -D, if a file with the same contents is on pCloud, it is
+    copied there by copyfile, and data is not uploaded; if
+    folderid/filename already has those contents, nothing is
+    done. Returns hex SHA-1 of data.
+    '''
+    if content_index is None:
+        return upload_file(pcloud, folderid, filename, data, name)
+    sha1 = scancache.digest(data)
+    file = content_index.find(pcloud, len(data), sha1)
+    if file is not None:
+        try:
+            if not content_index.holds(folderid, filename, file):
+                pcloud.binary_request('copyfile', {'fileid': file[0],
+                                                   'tofolderid': folderid,
+                                                   'toname': filename})
+                content_index.names[(folderid, filename)] = file[1]
+            content_index.saved(len(data))
+            transfers.add(-len(data), -1)
+            return sha1
+        except pcloudapi.PCloudException:
+            pass # e.g. deleted since listed; upload it instead
+        return upload_file(pcloud, folderid, filename, data, name, sha1)
+    try:
+        return upload_file(pcloud, folderid, filename, data, name, sha1)
+    finally:
+        content_index.uploaded(sha1)
 
 def download_file(pcloud, pathname):
     '''Download file from pCloud, named in pathname.'''
@@ -105,36 +479,130 @@ def download_file(pcloud, pathname):
             resp = pcloud.binary_request('getfilelink',
                                          {'fileid': fileid})
             url = f'https://{resp["hosts"][0]}{resp["path"]}'
-            data = pcloudapi.get_url(url)
+            data = pcloudapi.get_url(url, pcloud.ssl_context())
         else:
             pcloudapi.error(f'no such remote file: {pathname}')
     return data
 
-def download_file_id(pcloud, fileid):
-    '''Download file identified by fileid from pCloud.'''
+def download_file_id(pcloud, fileid, name='', size=0):
+    '''Download file identified by fileid from pCloud. name and size
+       describe the file in progress reports.'''
     data = None
     if fileid > 0:
         resp = pcloud.binary_request('getfilelink',
                                      {'fileid': fileid})
         url = f'https://{resp["hosts"][0]}{resp["path"]}'
-        data = pcloudapi.get_url(url)
+        stream = transfers.stream(name or str(fileid), size)
+
+        def update(nbytes):
+            if stream.update: stream.update(nbytes)
+            if bandwidth: bandwidth.wait(nbytes)
+            return
+
+        data = pcloudapi.get_url(url, pcloud.ssl_context(),
+                                 update if stream.update or bandwidth
+                                 else None)
+        stream.done()
     else:
         pcloudapi.error(f'no such remote file: {pathname}')
     return data
 
+def stream_file(pcloud, fileid, out, name='', size=0):
+    '''Download file identified by fileid from pCloud, writing it to
+       binary file object out as it arrives. name and size describe
+       the file in progress reports.'''
+    resp = pcloud.binary_request('getfilelink', {'fileid': fileid})
+    url = f'https://{resp["hosts"][0]}{resp["path"]}'
+    stream = transfers.stream(name or str(fileid), size)
+
+    def update(nbytes):
+        if stream.update: stream.update(nbytes)
+        if bandwidth: bandwidth.wait(nbytes)
+        return
+
+    try:
+        pcloudapi.copy_url(url, out, pcloud.ssl_context(), update)
+        out.flush()
+    except BrokenPipeError:
+        # the reader has gone (e.g. head); stop quietly, as cat does
+        os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+        sys.exit(1)
+    stream.done()
+    return
+
+def file_hash(pcloud, fileid):
+    '''Return pCloud content hash of file fileid.'''
+    if (hash := file_hashes.get(fileid)) is None:
+        resp = pcloud.binary_request('stat', {'fileid': fileid})
+        if resp['result'] != 0:
+            pcloudapi.error(f'no such remote file: {fileid}')
+        hash = file_hashes[fileid] = resp['metadata']['hash']
+    return hash
+
+def fetch_file(pcloud, fileid, dest, name='', size=0):
+    '''Download file identified by fileid from pCloud to local file
+       dest. name and size describe the file in progress reports.
+
+    With --cache, an unchanged file downloaded before is copied (or,
+    with --link, hard linked) from the local cache instead, and a file
+    downloaded is added to the cache.
+    '''
+    if file_cache is None:
+        write_file(dest, download_file_id(pcloud, fileid, name, size))
+        return
+    import filecache
+    hash = file_hash(pcloud, fileid)
+    if (path := file_cache.get(fileid, hash)) is None:
+        data = download_file_id(pcloud, fileid, name, size)
+        if (path := file_cache.put(fileid, hash, data)) is None:
+            write_file(dest, data)
+            return
+    else:
+        transfers.add(-size, -1)
+    try:
+        filecache.place(path, dest, Key.LINK in pcloud.config[Key.ASPECT])
+    except OSError as e:
+        pcloudapi.error(f'unable to open local file for writing: {e}')
+    return
+
 def write_file(filename, data):
     '''Create filename, with data as contents.'''
     try:
-        with open(filename, mode='wb') as f:
+        with profiler.span('write', file=filename), \
+             open(filename, mode='wb') as f:
             f.write(data)
     except Exception as e:
         pcloudapi.error(f'unable to open local file for writing: {e}')
     return
 
 def read_file(filename):
-    '''Return contents of local file identified by filenname.'''
+    '''Return contents of local file identified by filenname.
+
+    Files of MMAP_THRESHOLD bytes or more are returned as a memoryview
+    of the file mapped into memory, so that they are read only as they
+    are hashed and sent, and never copied into a buffer of our own.
+    The mapping is released when the memoryview is. Smaller files, and
+    files which cannot be mapped, are read as usual.
+
+    A mapped file must not be truncated while it is sent: reading the
+    pages lost raises SIGBUS, which ends pcutil. A file which grows is
+    sent as it was when mapped.
+    '''
     try:
-        data = open(filename, 'rb').read()
+        with profiler.span('read', file=filename), \
+             open(filename, 'rb') as f:
+            data = None
+            if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+                import mmap
+                try:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    if hasattr(data, 'madvise'):
+                        data.madvise(mmap.MADV_SEQUENTIAL)
+                    data = memoryview(data)
+                except (ValueError, OSError):
+                    data = None
+            if data is None:
+                data = f.read()
     except Exception as e:
         pcloudapi.error(f'unable to open file: {e}')
     return data
@@ -143,32 +611,30 @@ def copy_file(pcloud, source, dest):
     '''Copy single file from source to dest.'''
     dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
     if source['remote']:
-        if dryrun:
-            data = 'dummy'
+        source_file = source['filename']
+        destination = dest['filename']
+        if dest['isfolder']:
+            source_file = os.path.basename(source_file.strip('/'))
+            destination = os.path.join(destination, source_file)
         else:
-            data = download_file_id(pcloud, source['id'])
-        if data:
-            source_file = source['filename']
-            destination = dest['filename']
-            if dest['isfolder']:
-                source_file = os.path.basename(source_file.strip('/'))
-                destination = os.path.join(destination, source_file)
-            else:
-                if dest['id'] < 0:
-                    base, filename = os.path.split(destination)
-                    if base and not os.path.exists(base): os.makedirs(base)
+            if dest['id'] < 0:
+                base, filename = os.path.split(destination)
+                if base and not os.path.exists(base): os.makedirs(base)
 
-            if dryrun:
-                print(f'cp {("p:/"+source_file).replace("//", "/")} '\
-                      f'{destination}')
-            else:
-                write_file(destination, data)
+        size = file_sizes.get(source['id'], 0)
+        if dryrun:
+            print(f'cp {("p:/"+source_file).replace("//", "/")} '\
+                  f'{destination}')
+        elif dest['filename'] == STDIO:
+            transfers.add(size)
+            stream_file(pcloud, source['id'], sys.stdout.buffer,
+                        source['filename'], size)
         else:
-            pcloudapi.error('empty remote file contents: ' \
-                            f'{source["filename"]}')
+            transfers.add(size)
+            fetch_file(pcloud, source['id'], destination,
+                       source['filename'], size)
     else:
         source_file = source['filename']
-        data = read_file(source_file)
         destination = dest['filename']
         filename = os.path.basename(source_file)
         folderid = dest['id']
@@ -183,6 +649,9 @@ def copy_file(pcloud, source, dest):
                     else:
                         folderid = create_folders(pcloud, folder)
         elif dest['isfolder']:
+            if source_file == STDIO:
+                pcloudapi.error('cp: a file name is needed for standard '
+                                f'input, not folder: {destination}')
             filename = os.path.basename(source_file)
             folder = destination
         else:
@@ -192,14 +661,64 @@ def copy_file(pcloud, source, dest):
             # kludge, sigh
             dest_path = (folder+"/"+filename).strip('/')
             print(f'cp {source_file} p:/{dest_path}')
-
+        elif source_file == STDIO:
+            upload_stream(pcloud, folderid, filename, sys.stdin.buffer,
+                          'standard input')
         else:
-            upload_file(pcloud, folderid, filename, data)
+            data = read_file(source_file)
+            transfers.add(len(data))
+            if content_index is not None:
+                content_index.index(pcloud, folderid)
+            put_file(pcloud, folderid, filename, data, source_file)
+    return
+
+def run_transfers(pcloud, plan):
+    '''Run transfers in plan, a list of (size, function, args) tuples,
+       calling function(*args) for each, largest first, on up to
+       workers (-w) threads.
+
+    Each worker takes the largest transfer remaining when it becomes
+    free, so that a large file is not left to be transferred alone at
+    the end. The calling thread is one of the workers. After the first
+    failure, no further transfers are started; the failure is raised
+    once those in progress are done.
+    '''
+    workers = pcloud.config[Key.ASPECT][Key.WORKERS]
+    plan = sorted(plan, key=lambda transfer: transfer[0])
+    transfers.add(sum(size for size, _, _ in plan), len(plan))
+    lock = threading.Lock()
+    failures = []
+
+    def worker():
+        while True:
+            with lock:
+                if failures or not plan:
+                    return
+                _, function, args = plan.pop()
+            try:
+                function(*args)
+            except BaseException as err:
+                with lock:
+                    failures.append(err)
+        return
+
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(min(workers, len(plan)) - 1)]
+    for thread in threads:
+        thread.start()
+    worker()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
     return
 
 def copy_from_remote(pcloud, sourceid, source_file, dest):
-    '''Copy files recursively from pCloud.'''
+    '''Copy files recursively from pCloud. The folders are listed, and
+       local directories created, before any file is transferred.'''
     dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
+    plan = []
+
     for root, folders, files in pwalk(pcloud, sourceid, source_file):
         edest = normpath(dest+'/'+root[1].replace(source_file, ''))
         if os.path.exists(edest):
@@ -211,56 +730,202 @@ def copy_from_remote(pcloud, sourceid, source_file, dest):
             else:
                 os.makedirs(edest)
 
-        for fileid, filename in files:
+        for fileid, filename, size in files:
             edest = normpath(f'{dest}/{filename.replace(source_file,"")}')
             if dryrun:
                 print(f'cp p:{filename} {edest}')
             else:
-                data = download_file_id(pcloud, fileid)
-                if data: write_file(edest, data)
+                plan.append((size, fetch_file,
+                             (pcloud, fileid, edest, filename, size)))
+    run_transfers(pcloud, plan)
+    return
+
+def download_zip(pcloud, folderid, source_file, dest):
+    '''Copy pCloud folder folderid, named source_file, to local directory
+       dest as a single zip archive, extracting each file as it arrives.
+
+    One request and one download replace the getfilelink and download
+    of every file, which dominate the time taken to copy many small
+    files. The archive holds the folder itself, so the folder's name is
+    dropped from the names of its entries.
+    '''
+    import zipstream
+    resp = pcloud.binary_request('getziplink', {'folderid': folderid})
+    url = f'https://{resp["hosts"][0]}{resp["path"]}'
+    prefix = os.path.basename(source_file) + '/' if folderid else ''
+    stream = transfers.stream(f'p:{source_file or "/"} (zip)')
+    transfers.add(0)
+    nbytes = 0
+
+    def update(n):
+        nonlocal nbytes
+        nbytes += n
+        if stream.update: stream.update(n)
+        if bandwidth: bandwidth.wait(n)
+        return
+
+    start = time.perf_counter()
+    try:
+        os.makedirs(dest, exist_ok=True)
+        with profiler.span('download', url=url):
+            resp = pcloudapi.open_url(url, pcloud.ssl_context())
+            for entry, chunks in zipstream.entries(resp, update):
+                name = entry.name.removeprefix(prefix)
+                if name.startswith('/') or '..' in name.split('/'):
+                    pcloudapi.error(f'invalid name in zip archive: '
+                                    f'{entry.name}')
+                path = normpath(f'{dest}/{name}')
+                if entry.isdir:
+                    os.makedirs(path, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with profiler.span('write', file=path), \
+                     open(path, 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+    except zipstream.ZipError as e:
+        pcloudapi.error(f'cp: {e}: p:{source_file}')
+    except OSError as e:
+        pcloudapi.error(f'cp: unable to extract p:{source_file}: {e}')
+    pcloudapi.metrics.record('download', time.perf_counter() - start,
+                             len(url), nbytes, 0)
+    stream.done()
     return
 
 def copy_to_remote(pcloud, source, folderid, folder_name):
-    '''Copy files recursively to pCloud.'''
+    '''Copy files recursively to pCloud. The local tree is scanned, and
+       pCloud folders created, before any file is transferred.'''
     dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
     source_dir = source['filename']
-    folders = {}
     if folderid < 0:
         if dryrun:
             print(f'mkfolder p:{folder_name}')
+            folder_cache.add(folder_name, -1)
         else:
+            if content_index is not None:
+                # files alongside the new folder may be duplicates
+                isfolder, parentid = get_pathinfo(
+                    pcloud, os.path.dirname(folder_name.rstrip('/')) or '/')
+                if isfolder: content_index.index(pcloud, parentid)
             folderid = create_folders(pcloud, folder_name)
-    folders = {folder_name: folderid}
-    for root, dirs, files in os.walk(source_dir):
-        if source_dir != '/': root = root.replace(source_dir, '')
-        base, folder = os.path.split(root)
-        if not base:
-            base = folder_name
-        elif base == '/':
-            base = folder_name
-        else:
-            base = normpath(folder_name + '/' + base)
-        if base in folders:
-            baseid = folders[base]
-            if folder:
-                new_folder = normpath(base+'/'+folder)
-                if dryrun:
-                    print(f'mkfolder {normpath("p:/"+new_folder)}')
-                    folders[new_folder] = '[0]'
-                else:
-                    folders[new_folder] = baseid = \
-                        create_folder(pcloud, baseid, folder)
-        else:
-            pcloudapi.error(f'internal error: target folder doesn\'t exist: ' \
-                            f'{base}')
-        for file in files:
+    else:
+        folder_cache.seed(pcloud, folder_name, folderid, content_index)
+
+    def relpath(top, file):
+        return os.path.join(top, file)[len(source_dir):].lstrip('/')
+
+    def skip(err):
+        global unreadable
+        unreadable += 1
+        pcloudapi.error(f'cp: cannot read, skipped: {err.filename}: '
+                        f'{err.strerror}', die=False)
+        return
+
+    tree = scancache.walk(source_dir, skip)
+    cache = None
+    if Key.UPDATE in pcloud.config[Key.ASPECT]:
+        # only files changed since the last update are copied
+        cache = scancache.ScanCache(source_dir, folder_name)
+        tree = ((top, dirs, [(file, st) for file, st in files
+                             if not cache.unchanged(relpath(top, file), st)])
+                for top, dirs, files in tree)
+    plan = []
+
+    def upload(top, baseid, file, st, pathname):
+        data = read_file(pathname)
+        if cache and cache.same_content(relpath(top, file), st, data):
+            transfers.add(-len(data), -1)
+            return
+        sha1 = put_file(pcloud, baseid, file, data, pathname)
+        if cache: cache.record(relpath(top, file), st, sha1)
+        return
+
+    complete = False
+    try:
+        for top, dirs, files in tree:
+            root = top.replace(source_dir, '') if source_dir != '/' else top
+            target = normpath(folder_name + '/' + root)
             if dryrun:
-                print('cp ' \
-                      f'{normpath(source_dir+"/"+root+"/"+file)} ' \
-                      f'{normpath("p:"+folder_name+"/"+root+"/"+file)}')
+                if folder_cache.get(target) is None:
+                    print(f'mkfolder {normpath("p:/"+target)}')
+                    folder_cache.add(target, -1)
             else:
-                data = read_file(f'{source_dir}/{root}/{file}')
-                upload_file(pcloud, baseid, file, data)
+                baseid = create_folders(pcloud, target)
+            for file, st in files:
+                if dryrun:
+                    print('cp ' \
+                          f'{normpath(source_dir+"/"+root+"/"+file)} ' \
+                          f'{normpath("p:"+folder_name+"/"+root+"/"+file)}')
+                    continue
+                pathname = normpath(f'{source_dir}/{root}/{file}')
+                plan.append((st.st_size, upload,
+                             (top, baseid, file, st, pathname)))
+        run_transfers(pcloud, plan)
+        complete = True
+    finally:
+        if cache and not dryrun: cache.save(complete)
+    return
+
+def remote_target(pcloud, source, dest):
+    '''Return tuple of folderid and name for server-side copy/move of
+       source to dest. Missing destination folders are created.'''
+    dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
+    if dest['isfolder']:
+        return (dest['id'], os.path.basename(source['filename']))
+    folder, name = os.path.split(dest['filename'])
+    isfolder, folderid = get_pathinfo(pcloud, folder or '/')
+    if folderid < 0:
+        if dryrun:
+            print(f'mkfolder p:/{folder.strip("/")}')
+        else:
+            folderid = create_folders(pcloud, folder)
+    elif not isfolder:
+        pcloudapi.error(f'invalid destination: {dest["filename"]}')
+    return (folderid, name)
+
+def copy_remote(pcloud, source, dest):
+    '''Copy file or folder between pCloud locations.
+
+    The copy is made server-side by copyfile or copyfolder, so no
+    file contents are transferred. For a folder, dest names the
+    folder receiving the contents of source (see parse_filenames).
+    '''
+    dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
+    if dryrun:
+        print(f'cp {"-r " if source["isfolder"] else ""}'
+              f'p:{source["filename"]} p:{dest["filename"]}')
+        return
+    if source['isfolder']:
+        folderid = dest['id'] if dest['id'] >= 0 else \
+            create_folders(pcloud, dest['filename'])
+        pcloud.binary_request('copyfolder', {'folderid': source['id'],
+                                             'tofolderid': folderid,
+                                             'copycontentonly': 1})
+    else:
+        folderid, name = remote_target(pcloud, source, dest)
+        pcloud.binary_request('copyfile', {'fileid': source['id'],
+                                           'tofolderid': folderid,
+                                           'toname': name})
+    return
+
+def move(pcloud, files):
+    '''Move (or rename) file or folder between pCloud locations.'''
+    dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
+    source = files['source']
+    dest = files['dest']
+    if dryrun:
+        print(f'mv p:{source["filename"]} p:{dest["filename"]}')
+        return
+    folderid, name = remote_target(pcloud, source, dest)
+    if source['isfolder']:
+        pcloud.binary_request('renamefolder', {'folderid': source['id'],
+                                               'tofolderid': folderid,
+                                               'toname': name})
+        folder_cache.discard(source['filename'])
+    else:
+        pcloud.binary_request('renamefile', {'fileid': source['id'],
+                                             'tofolderid': folderid,
+                                             'toname': name})
     return
 
 def copy(pcloud, files):
@@ -270,16 +935,152 @@ def copy(pcloud, files):
     dest = files['dest']
     source_name = source['filename']
 
-    if not recursive:
-        copy_file(pcloud, source, dest)
+    if source['remote'] and dest['remote']:
+        copy_remote(pcloud, source, dest)
         return
-    dest_dir = dest['filename']
-    if source['remote']:
-         copy_from_remote(pcloud, source['id'], source['filename'], dest_dir)
+    if not recursive or not source['isfolder']:
+        copy_file(pcloud, source, dest)
+    else:
+        dest_dir = dest['filename']
+        if source['remote'] and Key.ZIP in pcloud.config[Key.ASPECT] and \
+           Key.DRYRUN not in pcloud.config[Key.ASPECT]:
+            download_zip(pcloud, source['id'], source['filename'], dest_dir)
+        elif source['remote']:
+            copy_from_remote(pcloud, source['id'], source['filename'],
+                             dest_dir)
+        else:
+            copy_to_remote(pcloud, source, dest['id'], dest_dir)
+    return
+
+def prefetch_pathinfo(pcloud, pairs):
+    '''Stat the pCloud pathnames named in pairs of source and
+       destination names as a single batch, so that get_pathinfo need
+       not wait on each in turn.'''
+    jobs = pcloud.config[Key.ASPECT][Key.JOBS]
+    recursive = Key.RECURSIVE in pcloud.config[Key.ASPECT]
+    paths = set()
+    for source_name, dest_name in pairs:
+        if source_name.startswith('p:'):
+            paths.add(normpath('/' + source_name[2:]))
+        if dest_name.startswith('p:'):
+            dest = normpath('/' + dest_name[2:])
+            paths.update((dest, os.path.dirname(dest)))
+            if recursive and not source_name.endswith('/'):
+                paths.add(normpath(dest + '/' + os.path.basename(source_name)))
+    paths = [path for path in paths
+             if folder_cache.get(path) is None and path not in pathinfo_cache]
+    with pcloud.batch(jobs) as batch:
+        for path in paths:
+            batch.stat(path=path)
+    for path, resp in zip(paths, batch.results):
+        if resp['result'] != 0:
+            pathinfo_cache[path] = (False, -1)
+        elif resp['metadata']['isfolder']:
+            folder_cache.add(path, resp['metadata']['folderid'])
+        else:
+            pathinfo_cache[path] = (False, resp['metadata']['fileid'])
+            file_hashes[resp['metadata']['fileid']] = resp['metadata']['hash']
+            file_sizes[resp['metadata']['fileid']] = resp['metadata']['size']
+    return
+
+def forget_pathinfo(path):
+    '''Drop prefetched stat results for path, and pathnames below it,
+       which a copy to path may have created.'''
+    path = normpath('/' + path)
+    prefix = path.rstrip('/') + '/'
+    for stale in [p for p in pathinfo_cache
+                  if p == path or p.startswith(prefix)]:
+        del pathinfo_cache[stale]
+    return
+
+def copy_files(pcloud, pairs):
+    '''Copy files named in pairs, an iterable of (source, destination)
+       name tuples, as cp.
+
+    Pairs are taken PREFETCH_CHUNK at a time, and the pCloud names in
+    each chunk looked up by a single batch of stat calls. Progress
+    (-P) is reported across all the copies.
+    '''
+    global transfers, content_index, bandwidth, file_cache, unreadable
+    dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
+    if Key.PROGRESS in pcloud.config[Key.ASPECT] and not dryrun:
+        transfers = progress.Progress(output=sys.stderr)
+    else:
+        transfers = progress.NullProgress()
+    if Key.DEDUP in pcloud.config[Key.ASPECT] and not dryrun:
+        content_index = ContentIndex(pcloud.config[Key.ASPECT][Key.JOBS])
     else:
-        copy_to_remote(pcloud, source, dest['id'], dest_dir)
+        content_index = None
+    if Key.BWLIMIT in pcloud.config[Key.ASPECT]:
+        bandwidth = throttle.Limiter(pcloud.config[Key.ASPECT][Key.BWLIMIT])
+    else:
+        bandwidth = None
+    if Key.CACHE in pcloud.config[Key.ASPECT] and not dryrun:
+        import filecache
+        file_cache = filecache.ContentCache(
+            size=pcloud.config[Key.ASPECT].get(Key.CACHE_SIZE,
+                                               filecache.CACHE_SIZE))
+    else:
+        file_cache = None
+    unreadable = 0
+    pairs = iter(pairs)
+    try:
+        while chunk := list(itertools.islice(pairs, PREFETCH_CHUNK)):
+            prefetch_pathinfo(pcloud, chunk)
+            for source_name, dest_name in chunk:
+                files = parse_filenames(pcloud, source_name, dest_name)
+                if DEBUG: print(files)
+                copy(pcloud, files)
+                if files['dest']['remote']:
+                    forget_pathinfo(files['dest']['filename'])
+    finally:
+        pathinfo_cache.clear()
+        file_hashes.clear()
+        file_sizes.clear()
+    transfers.finish()
+    if content_index is not None and content_index.files:
+        print(content_index.summary())
+    if file_cache is not None and file_cache.hits:
+        print(f'cp: {file_cache.hits} file(s), '
+              f'{progress.format_bytes(file_cache.hit_bytes)} copied from '
+              'local cache.')
+    if unreadable:
+        pcloudapi.error(f'cp: {unreadable} unreadable file(s) or '
+                        'directory(ies) not copied')
+    return
+
+def read_pairs(filename):
+    '''Yield (source, destination) name tuples read from filename, or
+       standard input if filename is '-'.
+
+    Each line holds a source and a destination, quoted as for the
+    shell if they contain spaces. Blank lines and comments (#) are
+    skipped.
+    '''
+    try:
+        f = sys.stdin if filename == '-' else open(filename)
+    except OSError as err:
+        pcloudapi.error(f'cp: unable to open {filename}: {err.strerror}')
+    for n, line in enumerate(f, 1):
+        try:
+            fields = shlex.split(line, comments=True)
+        except ValueError as err:
+            pcloudapi.error(f'cp: {filename}, line {n}: {err}')
+        if len(fields) == 2:
+            yield tuple(fields)
+        elif fields:
+            pcloudapi.error(f'cp: {filename}, line {n}: '
+                            'expected source and destination')
+    if f is not sys.stdin: f.close()
     return
 
+def is_folder(pcloud, name):
+    '''Return True if name, local or on pCloud (p: prefix), is an
+       existing folder.'''
+    if name.startswith('p:'):
+        return get_pathinfo(pcloud, normpath('/' + name[2:]))[0]
+    return os.path.isdir(munge_local_filename(name))
+
 def munge_local_filename(filename):
     if filename.startswith('..'):
         filename = filename.replace('..', os.path.dirname(os.getcwd()), 1)
@@ -288,7 +1089,7 @@ def munge_local_filename(filename):
     filename = os.path.expanduser(os.path.expandvars(filename))
     return filename
 
-def parse_filenames(pcloud, source_name, dest_name):
+def parse_filenames(pcloud, source_name, dest_name, command='cp'):
     '''Returns dict based on parsing source and destination paths.'''
     remote = [False, False]
     source = {}
@@ -296,21 +1097,30 @@ def parse_filenames(pcloud, source_name, dest_name):
     recursive = Key.RECURSIVE in pcloud.config[Key.ASPECT]
     source['remote'] = source_name.startswith('p:')
     dest['remote'] = dest_name.startswith('p:')
-    if source['remote'] == dest['remote']:
-        pcloudapi.error('cp: source and destination cannot be at same location')
+    if command == 'mv':
+        if not (source['remote'] and dest['remote']):
+            pcloudapi.error('mv: source and destination must be on pCloud')
+        recursive = False
+    elif not (source['remote'] or dest['remote']):
+        pcloudapi.error('cp: source and destination cannot both be local')
+    elif recursive and STDIO in (source_name, dest_name):
+        pcloudapi.error('cp: cannot copy standard input or output '
+                        'recursively')
 
+    # a folder is copied into dest_name, unless only its contents are
+    contents = source_name == '/' or source_name.endswith('/')
     if source_name != '/':
-        if source_name.endswith('/'):
-            source_name = source_name[:-1]
-        elif recursive:
-            dest_name = normpath(dest_name + '/' +
-                                 os.path.basename(source_name))
+        source_name = source_name.removesuffix('/')
+    basename = os.path.basename(source_name)
 
     if source['remote']:
         source_name = normpath(source_name[2:])
         isfolder, id = get_pathinfo(pcloud, source_name)
         source['isfolder'] = isfolder
         source['id'] = id
+    elif source_name == STDIO:
+        source['isfolder'] = False
+        source['id'] = 0
     else:
         source_name = munge_local_filename(source_name)
         source['isfolder'] = os.path.isdir(source_name)
@@ -318,18 +1128,27 @@ def parse_filenames(pcloud, source_name, dest_name):
     source['filename'] = source_name
     if source['id'] < 0:
         pcloudapi.error(f'source does not exist: {source_name}')
-    elif source['isfolder'] and not recursive:
+    elif source['isfolder'] and not recursive and command != 'mv':
         pcloudapi.error(f'cannot copy folder; use --recursive: {source_name}')
+    elif not source['isfolder']:
+        recursive = False # a file is copied as such, as by cp -r
+    if recursive and not contents:
+        dest_name = normpath(dest_name + '/' + basename)
 
     if dest['remote']:
         dest_name = dest_name[2:]
-    else:
+    elif dest_name != STDIO:
         dest_name = munge_local_filename(dest_name)
     dest['filename'] = dest_name
     if dest['remote']:
         isfolder, id = get_pathinfo(pcloud, dest_name)
         dest['isfolder'] = isfolder
         dest['id'] = id
+    elif dest_name == STDIO:
+        if source['isfolder']:
+            pcloudapi.error('cp: cannot copy a folder to standard output')
+        dest['isfolder'] = False
+        dest['id'] = 0
     else:
         dest['isfolder'] = os.path.isdir(dest_name)
         dest['id'] = 0 if os.path.exists(dest_name) else -1
@@ -338,72 +1157,243 @@ def parse_filenames(pcloud, source_name, dest_name):
 
     return {'source': source, 'dest': dest}
 
+def is_glob(pathname):
+    '''Return True if pathname contains glob pattern characters.'''
+    return any(c in pathname for c in '*?[')
+
+def resolve_pathnames(pcloud, pathnames):
+    '''Resolve remote pathnames, expanding glob patterns.
+
+    Glob patterns are recognised in the final pathname component
+    only. As with the shell, a leading '.' must be matched
+    explicitly. Each parent folder is listed once, however many
+    patterns refer to it, and all stat and listfolder calls are sent
+    as a single batch.
+
+    Returns tuple of list of targets, as (pathname, isfolder, id)
+    tuples, and list of pathnames (or patterns) that matched nothing.
+    '''
+    jobs = pcloud.config[Key.ASPECT][Key.JOBS]
+    patterns = {}
+    with pcloud.batch(jobs) as batch:
+        calls = []
+        for pathname in pathnames:
+            parent, pattern = os.path.split(pathname)
+            if is_glob(pattern) and not is_glob(parent):
+                if parent not in patterns:
+                    patterns[parent] = batch.add('listfolder',
+                                                 {'path': parent,
+                                                  'recursive': 0})
+                calls.append((pathname, patterns[parent]))
+            elif pathname == '/':
+                calls.append((pathname, None))
+            else:
+                calls.append((pathname, batch.stat(path=pathname)))
+    targets = []
+    missing = []
+    for pathname, index in calls:
+        if index is None:
+            targets.append((pathname, True, 0))
+            continue
+        resp = batch.results[index]
+        if resp['result'] != 0:
+            missing.append(pathname)
+        elif batch.requests[index][0] == 'stat':
+            meta = resp['metadata']
+            targets.append((pathname, meta['isfolder'],
+                            meta['folderid'] if meta['isfolder']
+                            else meta['fileid']))
+        else:
+            parent, pattern = os.path.split(pathname)
+            matched = [(normpath(f'{parent}/{entry["name"]}'),
+                        entry['isfolder'],
+                        entry['folderid'] if entry['isfolder']
+                        else entry['fileid'])
+                       for entry in resp['metadata']['contents']
+                       if fnmatch.fnmatchcase(entry['name'], pattern) and
+                       (pattern.startswith('.') or
+                        not entry['name'].startswith('.'))]
+            if matched:
+                targets += matched
+            else:
+                missing.append(pathname)
+    return (targets, missing)
+
 def rm(pcloud, pathnames):
+    '''Delete pCloud files and folders named in pathnames.
+
+    Pathnames may contain glob patterns (see resolve_pathnames). The
+    deletions are pipelined, with at most jobs calls in flight. A
+    summary is printed if more than one target is deleted.
+    '''
     recursive = Key.RECURSIVE in pcloud.config[Key.ASPECT]
     dryrun = Key.DRYRUN in pcloud.config[Key.ASPECT]
-    for pathname in pathnames:
-        if pathname.startswith('p:'): pathname = pathname[2:]
-        if not pathname.startswith('/'): pathname = '/' + pathname
-        isfolder, id = get_pathinfo(pcloud, pathname)
-        if id < 0:
-            pcloudapi.error(f'rm: no such file/folder: {pathname}', False)
-            continue
-        if isfolder:
-            if not recursive:
-                contents = get_contents(pcloud, id)
-                if len(contents) == 0:
-                    resp = pcloud.binary_request('deletefolder',
-                                                 {'folderid': id})
-                else:
-                    pcloudapi.error(f'cannot rm non-empty folder: use -r: ' \
-                                    f'{pathname}')
+    jobs = pcloud.config[Key.ASPECT][Key.JOBS]
+    verbose = pcloud.config[pcloudapi.Key.VERBOSE]
+    pathnames = [normpath('/' + (p[2:] if p.startswith('p:') else p))
+                 for p in pathnames]
+    targets, missing = resolve_pathnames(pcloud, pathnames)
+    for pathname in missing:
+        pcloudapi.error(f'rm: no such file/folder: {pathname}', False)
+    if dryrun:
+        for pathname, isfolder, id in targets:
+            print(f'rm {"-r " if isfolder and recursive else ""}{pathname}')
+        return
+
+    with pcloud.batch(jobs) as batch:
+        for pathname, isfolder, id in targets:
+            if not isfolder:
+                batch.deletefile(fileid=id)
+            elif recursive:
+                batch.add('deletefolderrecursive', {'folderid': id})
             else:
-                if dryrun:
-                    print(f'rm -r {pathname}')
-                else:
-                    resp = pcloud.binary_request('deletefolderrecursive',
-                                                 {'folderid': id})
-                    print(f'{pathname}: {resp["deletedfolders"]} folder(s), ' \
-                           f'{resp["deletedfiles"]} file(s) deleted.')
+                batch.deletefolder(folderid=id)
+    nfiles = nfolders = nfailed = 0
+    for (pathname, isfolder, id), resp in zip(targets, batch.results):
+        if isfolder and resp['result'] == 0:
+            folder_cache.discard(pathname)
+        if resp['result'] == 2006:
+            pcloudapi.error(f'cannot rm non-empty folder: use -r: ' \
+                            f'{pathname}', False)
+        elif resp['result'] != 0:
+            pcloudapi.error(f'rm: {pathname}: {resp["error"]}', False)
+        elif 'deletedfiles' in resp:
+            print(f'{pathname}: {resp["deletedfolders"]} folder(s), ' \
+                  f'{resp["deletedfiles"]} file(s) deleted.')
+            nfiles += resp['deletedfiles']
+            nfolders += resp['deletedfolders']
+            continue
         else:
-            if dryrun:
-                print(f'rm {pathname}')
-            else:
-                resp = pcloud.binary_request('deletefile', {'fileid': id})
+            nfiles += not isfolder
+            nfolders += isfolder
+            continue
+        nfailed += 1
+    if len(targets) > 1 or verbose:
+        print(f'rm: {nfiles} file(s), {nfolders} folder(s) deleted; ' \
+              f'{nfailed + len(missing)} error(s).')
+    if nfailed or missing:
+        sys.exit(1)
+    return
+
+def check_account(pcloud):
+    '''Clear the folder cache if it holds the folders of another
+       account or endpoint than pcloud's, as it may under pcloudd.py,
+       which runs commands given any -f, -e or -u option.'''
+    global folder_cache, folder_cache_account
+    account = (pcloud.config.get(pcloudapi.Key.ENDPOINT), pcloud.auth)
+    if account != folder_cache_account:
+        folder_cache = FolderCache()
+        folder_cache_account = account
+    return
+
+def end_command(failed):
+    '''Called by pcloudd.py after running each command. The folder
+       cache is kept for the next command, less dry-run placeholders;
+       after a failure, it is cleared, as a stale entry may be the
+       cause.'''
+    global folder_cache
+    if failed:
+        folder_cache = FolderCache()
+    else:
+        for path in [path for path, folderid in folder_cache.folders.items()
+                     if folderid == -1]:
+            del folder_cache.folders[path]
     return
 
 def main():
+    pcloudd.forward()
     pcloud = pcloudapi.PCloud()
-    pcloud.config[Key.ASPECT] = {}
+    pcloud.config[Key.ASPECT] = {Key.JOBS: binapi.PIPELINE_WINDOW,
+                                 Key.WORKERS: WORKERS}
     args = pcloud.merge_command_options(Key.ASPECT, {})
     if len(args) == 0:
         pcloudapi.error('usage: pcutil.py ' \
                         '[common_options] ' \
-                        '{cp [-dr] source destination | ' \
-                        'rm [-dr] file [file...]}')
+                        '{cp [-dDPru] [-w workers] [--bwlimit limit] ' \
+                        '[--cache] [--cache-size MiB] [--link] [--zip] ' \
+                        'source [source...] destination | ' \
+                        'cp [-dDPru] [-j jobs] [--bwlimit limit] ' \
+                        '[--cache ...] --from-file file | ' \
+                        'mv [-d] source destination | ' \
+                        'rm [-dr] [-j jobs] file [file...]}')
     # parse cmd args
     try:
-        opts, largs = getopt.getopt(args[1:], 'dr')
+        opts, largs = getopt.getopt(args[1:], 'dDj:rPuw:',
+                                    [Key.FROM_FILE+'=', Key.BWLIMIT+'=',
+                                     Key.CACHE, Key.CACHE_SIZE+'=', Key.LINK,
+                                     Key.ZIP])
         for o,v in opts:
-            if o == '-r':
+            if o == '--'+Key.FROM_FILE:
+                pcloud.config[Key.ASPECT][Key.FROM_FILE] = v
+            elif o in ('--'+Key.CACHE, '--'+Key.LINK, '--'+Key.ZIP):
+                pcloud.config[Key.ASPECT][o[2:]] = True
+            elif o == '--'+Key.CACHE_SIZE:
+                if not v.isdigit() or int(v) == 0:
+                    pcloudapi.error(f'{args[0]}: invalid cache size: {v}')
+                pcloud.config[Key.ASPECT][Key.CACHE] = True
+                pcloud.config[Key.ASPECT][Key.CACHE_SIZE] = int(v) * 1024**2
+            elif o == '--'+Key.BWLIMIT:
+                try:
+                    pcloud.config[Key.ASPECT][Key.BWLIMIT] = \
+                        throttle.parse_schedule(v)
+                except ValueError as err:
+                    pcloudapi.error(f'{args[0]}: {err}')
+            elif o == '-P':
+                pcloud.config[Key.ASPECT][Key.PROGRESS] = True
+            elif o == '-r':
                 pcloud.config[Key.ASPECT][Key.RECURSIVE] = True
             elif o == '-d':
                 pcloud.config[Key.ASPECT][Key.DRYRUN] = True
+            elif o == '-D':
+                pcloud.config[Key.ASPECT][Key.DEDUP] = True
+            elif o == '-u':
+                pcloud.config[Key.ASPECT][Key.UPDATE] = True
+            elif o == '-j':
+                pcloud.config[Key.ASPECT][Key.JOBS] = int(v)
+                if pcloud.config[Key.ASPECT][Key.JOBS] <= 0:
+                    raise ValueError
+            elif o == '-w':
+                pcloud.config[Key.ASPECT][Key.WORKERS] = int(v)
+                if pcloud.config[Key.ASPECT][Key.WORKERS] <= 0:
+                    raise ValueError
     except getopt.GetoptError as err:
         pcloudapi.error(f'{args[0]}: {err}')
+    except ValueError:
+        pcloudapi.error(f'{args[0]}: invalid number of '
+                        f'{"jobs" if o == "-j" else "workers"}: {v}')
 
     args[1:] = largs
-    if args[0] == 'cp' and len(args) != 3:
-        pcloudapi.error('usage: cp [-dr] source destination')
+    if args[0] == 'cp' and \
+       (len(args) != 1 if Key.FROM_FILE in pcloud.config[Key.ASPECT]
+        else len(args) < 3):
+        pcloudapi.error('usage: cp [-dDPru] [-w workers] [--bwlimit limit] '
+                        '[--cache] [--cache-size MiB] [--link] [--zip] '
+                        'source [source ...] destination'
+                        ' | cp [-dDPru] [-j jobs] [--bwlimit limit] '
+                        '[--cache ...] --from-file file')
+    elif args[0] == 'mv' and len(args) != 3:
+        pcloudapi.error('usage: mv [-d] source destination')
     elif args[0] == 'rm' and len(args) < 2:
-        pcloudapi.error('usage: rm [-dr] {file|folder}  [{file|folder} ...]')
+        pcloudapi.error('usage: rm [-dr] [-j jobs] {file|folder}  '
+                        '[{file|folder} ...]')
 
     try:
         pcloud.authenticate()
+        check_account(pcloud)
         if args[0] == 'cp':
-            files = parse_filenames(pcloud, args[1], args[2])
+            if Key.FROM_FILE in pcloud.config[Key.ASPECT]:
+                pairs = read_pairs(
+                    pcloud.config[Key.ASPECT][Key.FROM_FILE])
+            else:
+                if len(args) > 3 and not is_folder(pcloud, args[-1]):
+                    pcloudapi.error('cp: target is not a folder: '
+                                    f'{args[-1]}')
+                pairs = [(source, args[-1]) for source in args[1:-1]]
+            copy_files(pcloud, pairs)
+        elif args[0] == 'mv':
+            files = parse_filenames(pcloud, args[1], args[2], 'mv')
             if DEBUG: print(files)
-            copy(pcloud, files)
+            move(pcloud, files)
         elif args[0] == 'rm':
             rm(pcloud, args[1:])
         else:
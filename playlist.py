@@ -16,9 +16,12 @@
 '''
 import sys
 import os
+import re
 import getopt
 import urllib.parse
+import unicodedata
 import pcloudapi
+import pcloudd
 import time
 
 class Key():
@@ -40,21 +43,43 @@ class Key():
     ID = 'id'
     PATH = 'path'
 
-def walk(folder, root, fileid, types):
-    '''Recursively walk the pCloud directory structure.
+def music_matcher(types):
+    '''Return function matching names ending with a suffix in types.
 
-    folder contains music data structure.  root is current location in
-    folder. fileid is a dictionary to be updated with a mapping of mp3
-    file pathname to fileid. Types contains a list of recognised music
-    suffixes.
+    The suffixes are compiled into a single regular expression, so
+    each name is tested once regardless of the number of types.
+    '''
+    if not types:
+        return lambda name: None
+    return re.compile(f'(?:{"|".join(map(re.escape, types))})\\Z').search
+
+def walk(folder, types, root=''):
+    '''Walk the pCloud directory structure.
 
+    folder contains music data structure (a list of pCloud metadata
+    entries). root is the pathname of folder. types is either a list
+    of recognised music suffixes or a matcher returned by
+    music_matcher. Yields tuples of (pathname, fileid) for each music
+    file, in depth-first order.
+
+    The walk uses an explicit stack of iterators rather than
+    recursion, so deep nesting is not limited by the interpreter
+    stack. Folder contents are consumed lazily and in order, so
+    entries may be produced by a streaming decoder.
     '''
-    for entry in folder:
-        name = entry[Key.NAME]
-        if name.endswith(types):
-            fileid[f'{root}/{name}'] = entry[Key.FILEID]
-        if Key.CONTENTS in entry:
-            walk(entry[Key.CONTENTS], f'{root}/{name}', fileid, types)
+    match = types if callable(types) else music_matcher(types)
+    stack = [(root, iter(folder))]
+    while stack:
+        root, entries = stack[-1]
+        for entry in entries:
+            name = entry[Key.NAME]
+            if match(name):
+                yield (root + '/' + name, entry[Key.FILEID])
+            if Key.CONTENTS in entry:
+                stack.append((root + '/' + name, iter(entry[Key.CONTENTS])))
+                break
+        else:
+            stack.pop()
     return
 
 def get_music_dict(root_folder, types):
@@ -64,29 +89,114 @@ def get_music_dict(root_folder, types):
     are stripped of the root directory (e.g. /Music) Returns
     dictionary of music files keyed on name, value is fileid.
     '''
-    fileid = dict()
-    walk(root_folder, '', fileid, tuple(types))
-    return fileid
+    return dict(walk(root_folder, types))
 
-def read_m3u_file(filename, remove='/rep/music'):
-    '''Return list of music file pathnames from m3u filename.
-    The prefix identified by remove is stripped from each music file pathname.
+def m3u_track(entry, base, remove):
+    '''Return pCloud-relative pathname for a single m3u entry.
+
+    file:// URLs are unquoted and Windows separators are converted.
+    The prefix identified by remove is only stripped from the start of
+    the entry. Relative entries are resolved against base (the
+    playlist directory); if that does not lead under remove, the entry
+    is taken as relative to the music root.
     '''
     def make_abs(pathname):
-        return pathname if pathname[0] == '/' else '/' + pathname
+        return pathname if pathname.startswith('/') else '/' + pathname
+
+    def strip_prefix(pathname):
+        if remove and (pathname == remove or
+                       pathname.startswith(remove + '/')):
+            return pathname[len(remove):]
+        return None
 
-    with open(filename) as f:
-        lines = f.readlines()
-    return [make_abs(line.replace(remove, '').strip())  for line in lines]
+    if entry.startswith('file://'):
+        entry = urllib.parse.unquote(urllib.parse.urlsplit(entry).path)
+    entry = entry.replace('\\', '/')
+    if (track := strip_prefix(entry)) is not None:
+        return make_abs(track)
+    if not entry.startswith('/'):
+        track = strip_prefix(os.path.normpath(os.path.join(base, entry)))
+        if track is not None:
+            return make_abs(track)
+    return make_abs(entry)
+
+def read_m3u_file(filename, remove='/rep/music'):
+    '''Yield music file pathnames from m3u (or m3u8) filename.
+
+    Comment lines (#EXTM3U, #EXTINF etc.) and blank lines are
+    skipped. Each line is decoded as UTF-8, falling back to Latin-1 for
+    legacy m3u files. The prefix identified by remove is stripped from
+    each music file pathname.
+    '''
+    base = os.path.dirname(os.path.abspath(filename))
+    remove = remove.rstrip('/')
+    with open(filename, 'rb') as f:
+        for line in f:
+            try:
+                line = line.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                line = line.decode('latin-1')
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield m3u_track(line, base, remove)
+
+def normalize_track(pathname):
+    '''Return pathname in canonical form for track lookup.
+
+    Separators are normalized, and the name is case-folded and
+    converted to Unicode NFC, so that local and pCloud spellings of
+    the same pathname compare equal.
+    '''
+    pathname = '/'.join(p for p in pathname.replace('\\', '/').split('/')
+                        if p)
+    return '/' + unicodedata.normalize(
+        'NFC', unicodedata.normalize('NFD', pathname).casefold())
+
+def music_index(fileids):
+    '''Return lookup index for (pathname, fileid) pairs in fileids.
+
+    Index keys are normalized pathnames, values are tuples of
+    (pathname, fileid). Where distinct pCloud files normalize to the
+    same key, the value is a dict of their exact pathnames to fileid.
+    '''
+    index = dict()
+    for pathname, fileid in fileids:
+        key = normalize_track(pathname)
+        if (entry := index.get(key)) is None:
+            index[key] = (pathname, fileid)
+        elif isinstance(entry, dict):
+            entry[pathname] = fileid
+        else:
+            index[key] = {entry[0]: entry[1], pathname: fileid}
+    return index
+
+def resolve_tracks(index, tracks):
+    '''Look up tracks in index.
+
+    Return tuple of list of fileids found and list of tracks that
+    could not be resolved.
+    '''
+    ids = []
+    missing = []
+    for track in tracks:
+        entry = index.get(normalize_track(track))
+        if entry is None:
+            missing.append(track)
+        elif isinstance(entry, dict):
+            ids.append(entry.get(track, next(iter(entry.values()))))
+        else:
+            ids.append(entry[1])
+    return (ids, missing)
 
 def create_playlist(pcloud, name, ids):
     '''Create pCloud playlist.
 
     name contains the playlist name, while tracks are identified by
     the list ids. chunk-size controls how many fileids are uploaded in
-    each call to the pCloud API.
+    each call to the pCloud API; if 0, as many as fit in one call.
     '''
-    chunk_size = pcloud.config[Key.ASPECT][Key.CHUNK_SIZE]
+    chunk_size = min(pcloud.config[Key.ASPECT][Key.CHUNK_SIZE] or len(ids),
+                     pcloudapi.max_fileids(ids))
     chunk_ids, next_ids = pcloudapi.chunked(ids, chunk_size)
     result = pcloud.collection_create(name, chunk_ids)
     coll_id = result[Key.COLLECTION][Key.ID]
@@ -109,9 +219,13 @@ def pcloud_playlist_names(pcloud):
         pcloud_dict[coll[Key.NAME]] = coll[Key.ID]
     return pcloud_dict
 
-def upload_playlists(pcloud, fileids, files):
-    '''Convert and upload local m3u playlists to pCloud playlists.'''
-    chunk_size = pcloud.config[Key.ASPECT][Key.CHUNK_SIZE]
+def upload_playlists(pcloud, index, files):
+    '''Convert and upload local m3u playlists to pCloud playlists.
+
+    index is the music lookup index returned by music_index. Tracks
+    not found on pCloud are reported; the playlist is created from
+    the remaining tracks.
+    '''
     m3u_prefix = pcloud.config[Key.ASPECT][Key.PREFIX]
     dir = pcloud.config[Key.ASPECT][Key.DIR]
     verbose = pcloud.config[pcloudapi.Key.VERBOSE]
@@ -123,20 +237,25 @@ def upload_playlists(pcloud, fileids, files):
         if not os.path.exists(file):
             pcloudapi.error(f'playlist file does not exist: {file}',die=False)
             continue
-        pcloud_name = os.path.basename(file).replace('.m3u', '')
+        pcloud_name = os.path.splitext(os.path.basename(file))[0]
+        ids, missing = resolve_tracks(index,
+                                      read_m3u_file(file, remove=m3u_prefix))
+        if missing:
+            pcloudapi.error(f'{len(missing)} playlist track(s) not found on '
+                            f'pCloud (stale cache?): {file}', die=False)
+            for track in missing:
+                print(f'  {track}', file=sys.stderr)
+        if not ids:
+            pcloudapi.error(f'no tracks found; playlist skipped: {file}',
+                            die=False)
+            continue
         if verbose:
             print(f'Creating playlist {pcloud_name} ... ', end='')
             sys.stdout.flush()
-        m3u = read_m3u_file(file,remove=m3u_prefix)
         if pcloud_name in pcloud_playlists:
             pcloud.collection_delete(pcloud_playlists[pcloud_name])
             time.sleep(1)
-        try:
-            ids = [fileids[track] for track in m3u]
-        except KeyError as err:
-            pcloudapi.error(f'playlist track not found on pCloud '
-                            f'(stale cache?): {err}')
-        nchunks = create_playlist(pcloud, urllib.parse.quote(pcloud_name), ids)
+        nchunks = create_playlist(pcloud, pcloud_name, ids)
         if verbose: print(f'done using {nchunks} chunks.')
     return
 
@@ -146,10 +265,10 @@ def validate_config(config):
     if Key.CREATE_CACHE in playlist and not playlist[Key.CACHE_FILE]:
         pcloudapi.error('cache file name must be provided for create')
 
+    # fileids are sent by POST, so the number per call is limited only
+    # by pcloudapi.max_fileids; 0 means as many as fit
     chunk_size = int(playlist[Key.CHUNK_SIZE])
-    # more than 300 fileids seems to cause "Remote end closed
-    # connection without response"
-    if chunk_size <= 0 or chunk_size > 300:
+    if chunk_size < 0:
         pcloudapi.error(f'invalid chunk size specified: {chunk_size}')
     playlist[Key.CHUNK_SIZE] = chunk_size
     # convert command option string to list
@@ -193,19 +312,20 @@ def process_playlists(pcloud, pl_files):
                       'music collection from pCloud ...')
             folder = pcloud.list_folder(path=music_folder)
     try:
-        fileids = get_music_dict(folder[Key.METADATA][Key.CONTENTS],
-                                 pl_config[Key.MUSIC_TYPES])
+        index = music_index(walk(folder[Key.METADATA][Key.CONTENTS],
+                                 pl_config[Key.MUSIC_TYPES]))
     except KeyError as err:
         pcloudapi.error(f'unable to decode music_folder; corrupt cache?')
 
-    upload_playlists(pcloud, fileids, pl_files)
+    upload_playlists(pcloud, index, pl_files)
     return
 
 def main():
+    pcloudd.forward()
     # default playlist options
     playlist = {
         Key.CACHE_FILE: '',
-        Key.CHUNK_SIZE: 100,
+        Key.CHUNK_SIZE: 0,
         Key.MUSIC_FOLDER: '/Music',
         Key.MUSIC_TYPES: ['.mp3', '.m4a', '.flac', '.alac'],
         Key.DIR: '',
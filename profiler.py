@@ -0,0 +1,90 @@
+'''
+NAME
+ profiler.py - wall-clock span tracing for pcloud utilities
+
+DESCRIPTION
+ Records timed spans around hot paths (binary API encode, socket
+ send, wait and decode; local file I/O; JSON load and save) and
+ writes them as a Chrome trace-event JSON file, which can be viewed
+ with chrome://tracing or https://ui.perfetto.dev.
+
+ Spans are recorded with:
+
+   with profiler.span('encode', method=method):
+       ...
+
+ Arguments known only at the end of a span are added with set:
+
+   with profiler.span('connect', host=host) as span:
+       ...
+       span.set(resumed=resumed)
+
+ Until start() is called, span() returns a shared do-nothing context
+ manager, so instrumented code costs only a function call.
+'''
+
+import os
+import json
+import time
+import atexit
+import threading
+
+enabled = False
+events = []
+
+class _NullSpan():
+    '''Span recording nothing, returned by span() until start().'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def set(self, **args):
+        return
+
+_null_span = _NullSpan()
+
+class _Span():
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        return
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def set(self, **args):
+        '''Add args to those shown with the span.'''
+        self.args.update(args)
+        return
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.perf_counter_ns()
+        event = {'name': self.name, 'ph': 'X', 'pid': os.getpid(),
+                 'tid': threading.get_ident(),
+                 'ts': self.start / 1000, 'dur': (end - self.start) / 1000}
+        if self.args: event['args'] = self.args
+        # list.append is atomic, so no lock is needed between threads
+        events.append(event)
+        return False
+
+def span(name, **args):
+    '''Return context manager recording a span called name. args are
+       shown with the span in the trace viewer.'''
+    return _Span(name, args) if enabled else _null_span
+
+def start(filename):
+    '''Start recording spans; the trace is written to filename at exit.'''
+    global enabled
+    enabled = True
+    atexit.register(save, filename)
+    return
+
+def save(filename):
+    '''Write recorded spans to filename in Chrome trace-event format.'''
+    filename = os.path.expanduser(os.path.expandvars(filename))
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return
@@ -0,0 +1,180 @@
+'''
+NAME
+ progress.py - transfer progress reporting for pcloud utilities
+
+DESCRIPTION
+ Provides:
+  Progress, tracking bytes and files transferred against known totals
+  NullProgress, with the same interface, doing nothing
+
+ A Stream is obtained from Progress.stream() for each file
+ transferred; its update method is passed as the progress callback to
+ binapi/pcloudapi transfers. Several streams may be active at once.
+
+ On a terminal, a single status line (throughput, ETA and per-file
+ rates) is redrawn at most twice a second. Otherwise, a status line is
+ printed every ten seconds, and a line as each file completes, for use
+ in logs.
+'''
+
+import sys
+import time
+import shutil
+import threading
+
+def format_bytes(n):
+    'Return byte count n in human readable form.'
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(n) < 1024 or unit == 'TiB':
+            return f'{n:.0f} {unit}' if unit == 'B' else f'{n:.1f} {unit}'
+        n /= 1024
+    return
+
+def format_time(seconds):
+    'Return seconds as H:MM:SS.'
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}'
+
+class Stream():
+    '''Progress of a single file transfer.'''
+    def __init__(self, progress, name, size):
+        self.progress = progress
+        self.name = name
+        self.size = size
+        self.bytes = 0
+        self.start = time.monotonic()
+        return
+
+    def update(self, nbytes):
+        '''Record transfer of nbytes more bytes.'''
+        self.bytes += nbytes
+        self.progress.update(nbytes)
+        return
+
+    def rate(self, now):
+        elapsed = now - self.start
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def done(self):
+        '''Record completion of the transfer.'''
+        self.progress.stream_done(self)
+        return
+
+class Progress():
+    '''Aggregate progress of a set of file transfers.'''
+    def __init__(self, total_bytes=0, total_files=0, output=sys.stderr):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.output = output
+        self.tty = output.isatty()
+        self.interval = 0.5 if self.tty else 10.0
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.files = 0
+        self.streams = []
+        self.start = self.last_time = time.monotonic()
+        self.next_render = self.start + self.interval
+        self.last_bytes = 0
+        self.rate = 0.0
+        return
+
+    def add(self, nbytes, nfiles=1):
+        '''Add nbytes and nfiles to the totals to be transferred.'''
+        with self.lock:
+            self.total_bytes += nbytes
+            self.total_files += nfiles
+        return
+
+    def stream(self, name, size=0):
+        '''Return Stream for transfer of file name, of size bytes.'''
+        stream = Stream(self, name, size)
+        with self.lock:
+            self.streams.append(stream)
+        return stream
+
+    def update(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+        if time.monotonic() >= self.next_render:
+            self.render()
+        return
+
+    def stream_done(self, stream):
+        now = time.monotonic()
+        with self.lock:
+            self.files += 1
+            if stream in self.streams: self.streams.remove(stream)
+        if not self.tty:
+            print(f'{stream.name}: {format_bytes(stream.bytes)} in '
+                  f'{now - stream.start:.1f}s '
+                  f'({format_bytes(stream.rate(now))}/s)',
+                  file=self.output, flush=True)
+        return
+
+    def status(self, now):
+        '''Return status line.'''
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            rate = (self.bytes - self.last_bytes) / elapsed
+            # smooth the rate, so the ETA doesn't jump about
+            self.rate = rate if not self.rate else \
+                0.3 * rate + 0.7 * self.rate
+        self.last_time, self.last_bytes = now, self.bytes
+        line = f'{format_bytes(self.bytes)}'
+        if self.total_bytes:
+            line += f'/{format_bytes(self.total_bytes)} ' \
+                f'({100 * self.bytes // self.total_bytes}%)'
+        line += f' {self.files}'
+        if self.total_files:
+            line += f'/{self.total_files}'
+        line += f' files {format_bytes(self.rate)}/s'
+        if self.total_bytes and self.rate > 0:
+            eta = max(0, self.total_bytes - self.bytes) / self.rate
+            line += f' ETA {format_time(eta)}'
+        for stream in self.streams[:4]:
+            line += f' | {stream.name.rsplit("/", 1)[-1]} ' \
+                f'{format_bytes(stream.rate(now))}/s'
+        return line
+
+    def render(self):
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_render:
+                return
+            self.next_render = now + self.interval
+            line = self.status(now)
+        if self.tty:
+            width = shutil.get_terminal_size().columns - 1
+            print(f'\r{line[:width]:{width}}', end='', file=self.output,
+                  flush=True)
+        else:
+            print(line, file=self.output, flush=True)
+        return
+
+    def finish(self):
+        '''Print final summary.'''
+        elapsed = time.monotonic() - self.start
+        if self.tty:
+            print('\r' + ' ' * (shutil.get_terminal_size().columns - 1) +
+                  '\r', end='', file=self.output)
+        rate = self.bytes / elapsed if elapsed > 0 else 0.0
+        print(f'{self.files} file(s), {format_bytes(self.bytes)} in '
+              f'{format_time(elapsed)} ({format_bytes(rate)}/s)',
+              file=self.output, flush=True)
+        return
+
+class NullProgress():
+    '''Progress that records and reports nothing.'''
+    def add(self, nbytes, nfiles=1):
+        return
+
+    def stream(self, name, size=0):
+        return self
+
+    def done(self):
+        return
+
+    def finish(self):
+        return
+
+    update = None
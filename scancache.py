@@ -0,0 +1,125 @@
+'''
+NAME
+ scancache.py - local directory scanning, with a cache of file state
+
+DESCRIPTION
+ Provides:
+  walk, an os.walk using os.scandir, which yields the stat of each file
+  ScanCache, recording the size, modification time, inode number and
+   SHA-1 hash of each file in a local tree, as last copied to a
+   pCloud folder
+
+ A file whose size, modification time and inode number match its
+ cache entry is taken to be unchanged, without being read. A file
+ whose metadata has changed, but whose hash has not, is unchanged
+ too; its entry is updated.
+
+ Caches are stored as JSON files in CACHE_DIR, one for each pair of
+ local tree and pCloud folder.
+'''
+
+import os
+import json
+import hashlib
+import pcloudapi
+import profiler
+
+CACHE_DIR = '~/.cache/pcloud/scan'
+
+def walk(top, onerror=None):
+    '''Walk local tree top, top-down, as os.walk. For each directory,
+       yield tuple of its pathname, list of the names of its
+       sub-directories and list of (name, stat) tuples for its files.
+
+    The stat of each file is the one made by os.scandir, so callers
+    need not stat files again. As with os.walk, symbolic links to
+    directories are listed but not followed. Directories which cannot
+    be read, and files which cannot be stat'ed (e.g. dangling symbolic
+    links), are skipped; if onerror is given, it is called with the
+    OSError for each.
+    '''
+    stack = [top]
+    while stack:
+        root = stack.pop()
+        dirs = []
+        files = []
+        links = set()
+        try:
+            entries = list(os.scandir(root))
+        except OSError as err:
+            if onerror: onerror(err)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                    if entry.is_symlink(): links.add(entry.name)
+                else:
+                    files.append((entry.name, entry.stat()))
+            except OSError as err:
+                if onerror: onerror(err)
+        yield root, dirs, files
+        stack += [os.path.join(root, name) for name in reversed(dirs)
+                  if name not in links]
+    return
+
+def digest(data):
+    '''Return hex SHA-1 digest of data.'''
+    return hashlib.sha1(data).hexdigest()
+
+class ScanCache():
+    '''State of the files of local tree root, as last copied to pCloud
+       folder dest.
+
+    Entries are keyed by pathname relative to root, and hold a list of
+    size, modification time (ns), inode number and SHA-1 hash.
+    '''
+    def __init__(self, root, dest, directory=CACHE_DIR):
+        self.root = os.path.abspath(root)
+        self.dest = dest
+        key = digest(f'{self.root}\0{dest}'.encode())[:16]
+        self.filename = os.path.join(
+            os.path.expanduser(os.path.expandvars(directory)), key + '.json')
+        self.files = {}
+        self.seen = {}
+        try:
+            with profiler.span('json load', file=self.filename), \
+                 open(self.filename) as f:
+                cache = json.load(f)
+            if cache['root'] == self.root and cache['dest'] == dest:
+                self.files = cache['files']
+        except (OSError, ValueError, KeyError):
+            pass # no usable cache; every file is changed
+        return
+
+    def unchanged(self, path, st):
+        '''Return True if file path, with stat st, is unchanged by its
+           metadata alone.'''
+        entry = self.files.get(path)
+        if entry and entry[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+            self.seen[path] = entry
+            return True
+        return False
+
+    def same_content(self, path, st, data):
+        '''Return True if file path, with stat st, has contents data as
+           recorded for it; if so, its entry is updated. data is only
+           hashed if its size is unchanged.'''
+        entry = self.files.get(path)
+        if entry and entry[0] == st.st_size and entry[3] == digest(data):
+            self.record(path, st, entry[3])
+            return True
+        return False
+
+    def record(self, path, st, sha1):
+        '''Record file path, with stat st and hash sha1, as copied.'''
+        self.seen[path] = [st.st_size, st.st_mtime_ns, st.st_ino, sha1]
+        return
+
+    def save(self, complete=True):
+        '''Save the cache. If complete is True, the whole tree has been
+           scanned, and entries for files not seen are dropped.'''
+        files = self.seen if complete else {**self.files, **self.seen}
+        pcloudapi.save_json({'root': self.root, 'dest': self.dest,
+                             'files': files}, self.filename)
+        return
@@ -18,52 +18,58 @@ create_test_dirs() {
     cp $1/test/x $1/test/y $1/test/z $1/test/d2/d4
 }
 
+# Set PCUTIL_OPTS to pass common options to pcutil.py; e.g. to run
+# against a local mockserver.py:
+#   python mockserver.py --config /tmp/mock.json &
+#   PCUTIL_OPTS="-f /tmp/mock.json" sh test.sh
+PCUTIL="${PYTHON:-python} pcutil.py ${PCUTIL_OPTS}"
+
 echo "Running smoke test of pcutil.py. Expect no errors."
 TMP=$(mktemp -d)
 PTMP=$(echo $TMP|sed -e 's!/tmp/tmp.!!')
 
 create_test_dirs ${TMP}
 
-python pcutil.py cp -d pcutil.py p:/${PTMP}/new_pcutil.py
-python pcutil.py cp pcutil.py p:/${PTMP}/new_pcutil.py
+${PCUTIL} cp -d pcutil.py p:/${PTMP}/new_pcutil.py
+${PCUTIL} cp pcutil.py p:/${PTMP}/new_pcutil.py
 
-python pcutil.py cp -d pcutil.py p:/${PTMP}
-python pcutil.py cp pcutil.py p:/${PTMP}
+${PCUTIL} cp -d pcutil.py p:/${PTMP}
+${PCUTIL} cp pcutil.py p:/${PTMP}
 
-python pcutil.py cp -d p:/${PTMP}/new_pcutil.py ${TMP}/test/new1_pcutil.py
-python pcutil.py cp p:/${PTMP}/new_pcutil.py ${TMP}/test/new1_pcutil.py
+${PCUTIL} cp -d p:/${PTMP}/new_pcutil.py ${TMP}/test/new1_pcutil.py
+${PCUTIL} cp p:/${PTMP}/new_pcutil.py ${TMP}/test/new1_pcutil.py
 ls -l ${TMP}/test/new1_pcutil.py
 
-python pcutil.py cp pcutil.py p:/${PTMP}/nd1/nd2/pcutil.py
-python pcutil.py cp p:/${PTMP}/nd1/nd2/pcutil.py ${TMP}
+${PCUTIL} cp pcutil.py p:/${PTMP}/nd1/nd2/pcutil.py
+${PCUTIL} cp p:/${PTMP}/nd1/nd2/pcutil.py ${TMP}
 ls -l ${TMP}/pcutil.py
 
-python pcutil.py cp -d p:/${PTMP}/new_pcutil.py ${TMP}/new1_pcutil.py
-python pcutil.py cp p:/${PTMP}/new_pcutil.py ${TMP}/new1_pcutil.py
+${PCUTIL} cp -d p:/${PTMP}/new_pcutil.py ${TMP}/new1_pcutil.py
+${PCUTIL} cp p:/${PTMP}/new_pcutil.py ${TMP}/new1_pcutil.py
 ls -l ${TMP}/new1_pcutil.py
 
-python pcutil.py cp -dr ${TMP}/test p:/${PTMP}
-python pcutil.py cp -r ${TMP}/test p:/${PTMP}
+${PCUTIL} cp -dr ${TMP}/test p:/${PTMP}
+${PCUTIL} cp -r ${TMP}/test p:/${PTMP}
 mv ${TMP}/test ${TMP}/test.orig
 
-python pcutil.py cp -dr p:/${PTMP}/test ${TMP}
-python pcutil.py cp -r p:/${PTMP}/test ${TMP}
+${PCUTIL} cp -dr p:/${PTMP}/test ${TMP}
+${PCUTIL} cp -r p:/${PTMP}/test ${TMP}
 diff -r ${TMP}/test ${TMP}/test.orig
 
-python pcutil.py cp -dr p:/${PTMP}/test/ ${TMP}/x/y/test
-python pcutil.py cp -r  p:/${PTMP}/test/ ${TMP}/x/y/test
+${PCUTIL} cp -dr p:/${PTMP}/test/ ${TMP}/x/y/test
+${PCUTIL} cp -r  p:/${PTMP}/test/ ${TMP}/x/y/test
 diff -r ${TMP}/test ${TMP}/x/y/test
 
-python pcutil.py cp pcutil.py p:/${PTMP}/new_dir/new_file_name
-python pcutil.py cp p:/${PTMP}/new_dir/new_file_name ${TMP}
+${PCUTIL} cp pcutil.py p:/${PTMP}/new_dir/new_file_name
+${PCUTIL} cp p:/${PTMP}/new_dir/new_file_name ${TMP}
 ls -l ${TMP}/new_file_name
 
 rm -rf ${TMP}
 
 echo "Removing test folders and files from pCloud in five seconds"
 sleep 5
-python pcutil.py rm ${PTMP}/pcutil.py ${PTMP}/new_pcutil.py ${PTMP}/new_dir/new_file_name
+${PCUTIL} rm ${PTMP}/pcutil.py ${PTMP}/new_pcutil.py ${PTMP}/new_dir/new_file_name
 sleep 1
-python pcutil.py rm ${PTMP}/new_dir
-python pcutil.py rm -r ${PTMP}/test ${PTMP}/nd1
-python pcutil.py rm ${PTMP}
+${PCUTIL} rm ${PTMP}/new_dir
+${PCUTIL} rm -r ${PTMP}/test ${PTMP}/nd1
+${PCUTIL} rm ${PTMP}
@@ -0,0 +1,123 @@
+'''
+NAME
+ throttle.py - bandwidth limiting for pcloud utilities
+
+DESCRIPTION
+ Provides:
+  parse_schedule, parsing a bandwidth limit, or a time-of-day schedule
+   of limits
+  Limiter, a token bucket shared by all the transfers of a process
+
+ A limit is a rate in bytes per second, with an optional suffix of B,
+ K, M or G (powers of 1024); a number alone is in KiB/s, as for rsync.
+ off means no limit. A schedule is a space-separated list of
+ HH:MM,limit entries, each limit applying from its time of day until
+ the next entry's, e.g.
+
+   08:00,512K 18:00,4M 23:00,off
+
+ The last entry applies before the first, so the schedule repeats
+ daily.
+
+ Limiter.wait is called with the number of bytes in each chunk of
+ data sent or received, by any number of threads. It sleeps as needed
+ to hold their combined rate to the current limit.
+'''
+
+import time
+import threading
+
+UNITS = {'B': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+# Bytes which may be sent at once after an idle period, in seconds at
+# the current limit
+BURST = 0.25
+
+# Smallest burst, in bytes; one chunk of a binapi or download transfer
+MIN_BURST = 65536
+
+def parse_rate(rate):
+    '''Return limit rate in bytes per second, or None for off. Raises
+       ValueError if rate is invalid.'''
+    spec = rate.strip().upper()
+    if spec == 'OFF':
+        return None
+    number, unit = (spec[:-1], spec[-1]) if spec[-1:] in UNITS \
+        else (spec, 'K')
+    try:
+        value = float(number) * UNITS[unit]
+    except ValueError:
+        value = 0
+    if not value > 0:
+        raise ValueError(f'invalid bandwidth limit: {rate}')
+    return value
+
+def parse_schedule(spec):
+    '''Return schedule spec, a limit or list of HH:MM,limit entries, as
+       list of (minute of day, bytes per second or None) tuples, in
+       time order. Raises ValueError if spec is invalid.'''
+    entries = spec.split()
+    if len(entries) == 1 and ',' not in entries[0]:
+        return [(0, parse_rate(entries[0]))]
+    schedule = []
+    for entry in entries:
+        start, _, rate = entry.partition(',')
+        hours, _, minutes = start.partition(':')
+        if not (hours.isdigit() and minutes.isdigit() and
+                int(hours) < 24 and int(minutes) < 60):
+            raise ValueError(f'invalid bandwidth schedule time: {start}')
+        schedule.append((int(hours) * 60 + int(minutes), parse_rate(rate)))
+    if not schedule:
+        raise ValueError('empty bandwidth schedule')
+    return sorted(schedule)
+
+class Limiter():
+    '''Token bucket holding the combined rate of all transfers to the
+       limit set by schedule (see parse_schedule) for the time of day.
+
+    Tokens may go negative: a caller taking more than are available
+    sleeps until its debt is repaid, and later callers wait behind
+    it, so the limit holds however many threads share the bucket.
+    '''
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.lock = threading.Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        return
+
+    def limit(self):
+        '''Return the limit now in force, in bytes per second, or None.'''
+        if len(self.schedule) == 1:
+            return self.schedule[0][1]
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        rate = self.schedule[-1][1]
+        for start, limit in self.schedule:
+            if start > minute:
+                break
+            rate = limit
+        return rate
+
+    def wait(self, nbytes):
+        '''Account for transfer of nbytes, sleeping as needed to keep to
+           the limit.'''
+        with self.lock:
+            rate = self.limit()
+            now = time.monotonic()
+            if rate != self.rate:
+                # new limit in force; start with an empty bucket
+                self.rate = rate
+                self.tokens = 0.0
+            elif rate is not None:
+                burst = max(rate * BURST, MIN_BURST)
+                self.tokens = min(burst,
+                                  self.tokens + (now - self.last) * rate)
+            self.last = now
+            if rate is None:
+                return
+            self.tokens -= nbytes
+            delay = -self.tokens / rate if self.tokens < 0 else 0.0
+        if delay: time.sleep(delay)
+        return
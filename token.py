@@ -12,6 +12,7 @@ For more, see README_token.md
 '''
 
 import pcloudapi
+import pcloudd
 import sys
 
 class Key():
@@ -45,6 +46,7 @@ def list_tokens(tokens):
     return
 
 def main():
+    pcloudd.forward()
     pcloud = pcloudapi.PCloud()
     aspect_opts = (Key.DELETE+'=', Key.LIST)
     pcloud.config[Key.ASPECT] = {}
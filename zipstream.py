@@ -0,0 +1,229 @@
+'''
+NAME
+ zipstream.py - extraction of zip archives as they are read
+
+DESCRIPTION
+ Provides:
+  entries, yielding the entries of a zip archive read from a
+   non-seekable binary file object, such as an HTTP response
+  ZipError, raised for an archive that cannot be extracted
+
+ zipfile needs the central directory, at the end of an archive, before
+ it can read any entry. entries reads the local header before each
+ entry's data instead, so an archive streamed from pCloud (getziplink)
+ can be extracted while it downloads, in constant memory.
+
+ Archives made on the fly, as pCloud's are, give each entry's size and
+ CRC in a data descriptor after its data (flag bit 3). The end of a
+ deflated entry is found by decompressing it; the end of a stored one
+ by finding a data descriptor whose size and CRC match the data read.
+ Stored and deflated entries are supported, with zip64 sizes.
+'''
+
+import zlib
+import struct
+
+# Size of reads from the archive
+CHUNK = 65536
+
+LOCAL_HEADER = b'PK\x03\x04'
+DESCRIPTOR = b'PK\x07\x08'
+# Signatures of the records following the last entry
+END_RECORDS = (b'PK\x01\x02', b'PK\x06\x06', b'PK\x06\x07', b'PK\x05\x06')
+
+ZIP64_EXTRA = 0x0001
+FLAG_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+# Compression methods supported
+STORED = 0
+DEFLATED = 8
+
+class ZipError(Exception):
+    '''Raised for an invalid, truncated or unsupported zip archive.'''
+    pass
+
+class Reader():
+    '''Buffered reader of file object f, to which data may be returned
+       with unread. progress, if given, is called with the number of
+       bytes in each read of f.'''
+    def __init__(self, f, progress=None):
+        self.f = f
+        self.progress = progress
+        self.buf = b''
+        return
+
+    def fill(self, nbytes=1):
+        '''Read until at least nbytes are buffered, or f is exhausted.
+           Return True if nbytes are buffered.'''
+        while len(self.buf) < nbytes:
+            chunk = self.f.read(CHUNK)
+            if not chunk:
+                return False
+            if self.progress: self.progress(len(chunk))
+            self.buf += chunk
+        return True
+
+    def read(self, nbytes):
+        '''Return nbytes bytes; raise ZipError if fewer remain.'''
+        if not self.fill(nbytes):
+            raise ZipError('truncated zip archive')
+        data, self.buf = self.buf[:nbytes], self.buf[nbytes:]
+        return data
+
+    def read_some(self):
+        '''Return buffered bytes, or the next chunk of f; b'' at end.'''
+        self.fill()
+        data, self.buf = self.buf, b''
+        return data
+
+    def unread(self, data):
+        self.buf = data + self.buf
+        return
+
+class Entry():
+    '''Entry of a zip archive: name, isdir, and the CRC and sizes from
+       its local header (zero if they follow its data).'''
+    def __init__(self, header, name, extra):
+        (_, self.flags, self.method, _, _, self.crc, self.csize,
+         self.usize, _, _) = header
+        self.name = name
+        self.isdir = name.endswith('/')
+        self.zip64 = False
+        # zip64 sizes replace those of 0xFFFFFFFF in the header
+        while len(extra) >= 4:
+            tag, size = struct.unpack('<HH', extra[:4])
+            if tag == ZIP64_EXTRA:
+                self.zip64 = True
+                fields = extra[4:4+size]
+                if self.usize == 0xFFFFFFFF and len(fields) >= 8:
+                    self.usize, = struct.unpack('<Q', fields[:8])
+                    fields = fields[8:]
+                if self.csize == 0xFFFFFFFF and len(fields) >= 8:
+                    self.csize, = struct.unpack('<Q', fields[:8])
+            extra = extra[4+size:]
+        return
+
+def entries(f, progress=None):
+    '''Yield (Entry, chunks) for each entry of the zip archive read from
+       file object f, where chunks is an iterator of the entry's
+       uncompressed contents. Each entry's chunks must be consumed, or
+       discarded, before the next entry is taken. progress, if given,
+       is called with the number of bytes in each read of f.
+
+    Raises ZipError if the archive is invalid, truncated or uses an
+    unsupported compression method, or if an entry's CRC or size does
+    not match its contents.
+    '''
+    reader = Reader(f, progress)
+    while True:
+        signature = reader.read(4)
+        if signature in END_RECORDS:
+            break
+        if signature != LOCAL_HEADER:
+            raise ZipError('bad zip local header signature')
+        header = struct.unpack('<HHHHHLLLHH', reader.read(26))
+        raw = reader.read(header[8])
+        extra = reader.read(header[9])
+        name = raw.decode('utf-8' if header[1] & FLAG_UTF8 else 'cp437')
+        entry = Entry(header, name, extra)
+        if entry.method not in (STORED, DEFLATED):
+            raise ZipError(f'unsupported compression method '
+                                     f'{entry.method}: {name}')
+        chunks = contents(reader, entry)
+        yield entry, chunks
+        # drain whatever the caller did not read
+        for _ in chunks:
+            pass
+    return
+
+def contents(reader, entry):
+    '''Yield uncompressed contents of entry, whose data reader is at,
+       checking them against its CRC and size.'''
+    crc = 0
+    usize = 0
+    csize = 0
+    descriptor = entry.flags & FLAG_DESCRIPTOR
+    if entry.method == DEFLATED:
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        remaining = None if descriptor else entry.csize
+        while not inflater.eof:
+            if remaining == 0:
+                raise ZipError(f'bad deflate data: {entry.name}')
+            data = reader.read_some() if remaining is None else \
+                reader.read(min(CHUNK, remaining))
+            if not data:
+                raise ZipError('truncated zip archive')
+            if remaining is not None: remaining -= len(data)
+            try:
+                chunk = inflater.decompress(data)
+            except zlib.error as e:
+                raise ZipError(f'{e}: {entry.name}')
+            reader.unread(inflater.unused_data)
+            if remaining is not None: remaining += len(inflater.unused_data)
+            csize += len(data) - len(inflater.unused_data)
+            crc = zlib.crc32(chunk, crc)
+            usize += len(chunk)
+            if chunk: yield chunk
+        if descriptor:
+            entry.crc, entry.csize, entry.usize = read_descriptor(reader,
+                                                                 entry)
+    elif descriptor:
+        # stored, of unknown size: the data ends at the first descriptor
+        # signature followed by the CRC and size of the data before it
+        size = 24 if entry.zip64 else 16
+        scan = 0
+        while True:
+            at = reader.buf.find(DESCRIPTOR, scan)
+            if at < 0:
+                # all but a possible partial signature is data
+                keep = len(DESCRIPTOR) - 1
+                if len(reader.buf) > keep:
+                    chunk = reader.buf[:-keep]
+                    reader.buf = reader.buf[-keep:]
+                    crc = zlib.crc32(chunk, crc)
+                    usize += len(chunk)
+                    yield chunk
+                scan = 0
+                if not reader.fill(len(reader.buf) + 1):
+                    raise ZipError('truncated zip archive')
+                continue
+            if not reader.fill(at + size):
+                raise ZipError('truncated zip archive')
+            found = parse_descriptor(reader.buf[at+4:at+size], entry.zip64)
+            if found[1] == found[2] == usize + at and \
+               found[0] == zlib.crc32(reader.buf[:at], crc):
+                chunk = reader.buf[:at]
+                reader.buf = reader.buf[at+size:]
+                crc = zlib.crc32(chunk, crc)
+                usize += len(chunk)
+                if chunk: yield chunk
+                entry.crc, entry.csize, entry.usize = found
+                break
+            scan = at + 1 # signature bytes within the data
+        csize = usize
+    else:
+        remaining = entry.csize
+        while remaining:
+            chunk = reader.read(min(CHUNK, remaining))
+            remaining -= len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            usize += len(chunk)
+            yield chunk
+        csize = usize
+    if crc != entry.crc or usize != entry.usize or csize != entry.csize:
+        raise ZipError(f'bad CRC or size: {entry.name}')
+    return
+
+def parse_descriptor(data, zip64):
+    '''Return (crc, csize, usize) from data descriptor fields data.'''
+    return struct.unpack('<LQQ' if zip64 else '<LLL', data)
+
+def read_descriptor(reader, entry):
+    '''Read data descriptor of entry, with or without signature, and
+       return (crc, csize, usize).'''
+    size = 20 if entry.zip64 else 12
+    signature = reader.read(4)
+    if signature != DESCRIPTOR:
+        reader.unread(signature)
+    return parse_descriptor(reader.read(size), entry.zip64)